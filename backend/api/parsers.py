@@ -0,0 +1,24 @@
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+from project import codec
+
+from .renderers import FastJSONRenderer
+
+
+class FastJSONParser(JSONParser):
+    """``JSONParser`` that decodes with ``project.codec`` (orjson when installed)"""
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        try:
+            data = stream.read() if stream is not None else b''
+            if encoding.lower().replace('-', '') != 'utf8':
+                data = data.decode(encoding)
+            return codec.loads(data)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
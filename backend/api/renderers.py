@@ -0,0 +1,19 @@
+from rest_framework.renderers import JSONRenderer
+
+from project import codec
+
+
+class FastJSONRenderer(JSONRenderer):
+    """``JSONRenderer`` that encodes with ``project.codec`` (orjson when installed).
+
+    Output is byte-for-byte what ``JSONRenderer`` writes. Requests for
+    indented output (``?format=json; indent=4`` or the browsable API) still
+    go through the standard library.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return codec.dumps(data)
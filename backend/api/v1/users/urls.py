@@ -10,6 +10,7 @@ urlpatterns = [
     path('call/find-match/', views.FindMatchView.as_view(), name='find-match'),
     path('call/skip/', views.SkipCallView.as_view(), name='skip-call'),
     path('call/end/', views.EndCallView.as_view(), name='end-call'),
+    path('call/<str:call_id>/', views.CallDetailView.as_view(), name='call-detail'),
     path('call/<str:call_id>/messages/', views.GetMessagesView.as_view(), name='get-messages'),
     path('call/<str:call_id>/messages/send/', views.SendMessageView.as_view(), name='send-message'),
     path('call/<str:call_id>/messages/clear/', views.ClearMessagesView.as_view(), name='clear-messages'),
@@ -5,69 +5,88 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.utils import timezone
-from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag
 from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+import hashlib
+import logging
+import time
 import uuid
-import random
-import string
-from datetime import timedelta
 
 from users.models import User, VideoCall, ChatMessage, UserSession
-from users.serializers import (
-    UserSerializer, VideoCallSerializer, ChatMessageSerializer,
-    CreateVideoCallSerializer, JoinVideoCallSerializer, SendMessageSerializer
-)
+from users.auth import user_cache
+from users.chat import chat_buffer, decode_cursor, encode_cursor, message_page, next_cursor
+from users.lifecycle import IllegalTransition, create_call, finish_call
+from users.matchmaking import match_queue, find_match, match_payload, notify_match
+from users.presence import presence
+from users.versions import call_versions
+from users.expiry import presence_expiry
+from users.pool import account_pool
+from users.serializers import call_data, message_data, messages_data, user_data
+
+
+logger = logging.getLogger(__name__)
+
+
+def poll_validators(request, call_id, kind):
+    """ETag and Last-Modified for a polled part of a call, from its version stamp.
+
+    Last-Modified only has one-second resolution, so it is left out until
+    the second of the last change is over; otherwise a second change in
+    the same second would look unmodified to If-Modified-Since.
+    """
+    stamp = call_versions.get(call_id, kind)
+    # Pages of the same call differ, so the query string is part of the tag
+    digest = hashlib.md5(request.get_full_path().encode()).hexdigest()[:8]
+    etag = quote_etag(f'{kind}-{stamp:x}-{digest}')
+    last_modified = stamp // 10**9
+    if time.time() < last_modified + 1:
+        last_modified = None
+    return etag, last_modified
+
+
+def with_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Always revalidate; a 304 is cheap and the data changes without notice
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
 @method_decorator(csrf_exempt, name='dispatch')
 class UserRegistrationView(APIView):
     permission_classes = [AllowAny]
     
-    def generate_username(self):
-        """Generate a unique username"""
-        while True:
-            # Generate a random username like "User_ABC123"
-            prefix = "User"
-            suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-            username = f"{prefix}_{suffix}"
-            
-            if not User.objects.filter(username=username).exists():
-                return username
-    
     def post(self, request):
         try:
-            # Generate unique username
-            username = self.generate_username()
+            # Anonymous account: one created ahead of time if the pool has
+            # any, otherwise generated username, no password, one INSERT
+            user = account_pool.claim()
+            if user is None:
+                user = User.objects.create_anonymous_user(
+                    is_online=True,
+                    last_seen=timezone.now()
+                )
             
-            # Create user with random password
-            password = ''.join(random.choices(string.ascii_letters + string.digits, k=12))
-            user = User.objects.create_user(
-                username=username,
-                password=password,
-                is_online=True,
-                last_seen=timezone.now()
-            )
-            
-            print(f"Created user: {username}, is_online: {user.is_online}")
+            logger.info("Registered user", extra={'user_id': user.id})
             
             # Generate tokens
             refresh = RefreshToken.for_user(user)
             access_token = str(refresh.access_token)
             refresh_token = str(refresh)
             
-            # Serialize user data
-            user_data = UserSerializer(user).data
-            
             return Response({
-                'user': user_data,
+                'user': user_data(user),
                 'access_token': access_token,
                 'refresh_token': refresh_token
             }, status=status.HTTP_201_CREATED)
             
-        except Exception as e:
-            print(f"Error creating user: {e}")
+        except Exception:
+            logger.exception("Error creating user")
             return Response({'error': 'Failed to create user'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -76,10 +95,7 @@ class UserStatusView(APIView):
     permission_classes = [IsAuthenticated]
     
     def post(self, request):
-        user = request.user
-        user.is_online = True
-        user.last_seen = timezone.now()
-        user.save()
+        presence.touch(request.user.id)
         
         return Response({'status': 'online'})
 
@@ -90,27 +106,21 @@ class CreateVideoCallView(APIView):
     
     def post(self, request):
         user = request.user
-        print(f"Creating video call for user: {user.username}")
-        print(f"User {user.username} - is_online: {user.is_online}, is_looking_for_call: {user.is_looking_for_call}, current_call: {user.current_call}")
-        
         # Check if user is already in a call
-        if user.current_call:
-            print(f"User {user.username} is already in a call")
+        if user.current_call_id:
+            logger.debug("User is already in a call", extra={'user_id': user.id, 'call_id': user.current_call_id})
             return Response({'error': 'User is already in a call'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create new video call
-        call = VideoCall.objects.create(initiator=user)
-        user.current_call = call
-        user.is_looking_for_call = True
-        user.is_online = True
-        user.last_seen = timezone.now()
-        user.save()
+        try:
+            call = create_call(user)
+        except IllegalTransition as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        presence.touch(user.id)
+        match_queue.enqueue(user.id, call.id)
         
-        print(f"Created call {call.id} for user {user.username}")
-        print(f"Updated user {user.username} - is_online: {user.is_online}, is_looking_for_call: {user.is_looking_for_call}, current_call: {user.current_call}")
+        logger.debug("Created call", extra={'user_id': user.id, 'call_id': call.id})
         
-        serializer = VideoCallSerializer(call)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(call_data(call), status=status.HTTP_201_CREATED)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -119,171 +129,24 @@ class FindMatchView(APIView):
     
     def post(self, request):
         user = request.user
-        print(f"Finding match for user: {user.username}")
-        print(f"User {user.username} - is_online: {user.is_online}, is_looking_for_call: {user.is_looking_for_call}, current_call: {user.current_call}")
-        
         # Check if user has an active call
         if not user.current_call:
-            print(f"User {user.username} has no active call")
             return Response({'error': 'No active call found'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Mark user as online and looking for call
-        user.is_online = True
-        user.is_looking_for_call = True
-        user.last_seen = timezone.now()
-        user.save()
-        print(f"Updated user {user.username} - is_online: {user.is_online}, is_looking_for_call: {user.is_looking_for_call}")
-        
-        # First, try to find users who are currently looking for calls
-        available_users = User.objects.filter(
-            is_looking_for_call=True,
-            is_online=True,
-            current_call__isnull=False
-        ).exclude(id=user.id)
-        
-        print(f"Currently looking for calls: {available_users.count()}")
-        for available_user in available_users:
-            print(f"  - {available_user.username} (call: {available_user.current_call.id}, online: {available_user.is_online}, looking: {available_user.is_looking_for_call})")
-        
-        if available_users.exists():
-            # Get the first available user
-            matched_user = available_users.first()
-            matched_call = matched_user.current_call
-            
-            print(f"Matched {user.username} with {matched_user.username} (current user)")
-            
-            # Update both calls to connect them
-            with transaction.atomic():
-                user.current_call.participant = matched_user
-                user.current_call.status = 'active'
-                user.current_call.started_at = timezone.now()
-                user.current_call.save()
-                
-                matched_user.current_call.participant = user
-                matched_user.current_call.status = 'active'
-                matched_user.current_call.started_at = timezone.now()
-                matched_user.current_call.save()
-                
-                # Update user status
-                user.is_looking_for_call = False
-                matched_user.is_looking_for_call = False
-                user.save()
-                matched_user.save()
-            
-            serializer = VideoCallSerializer(user.current_call)
-            return Response({
-                'matched': True,
-                'call': serializer.data,
-                'matched_user': UserSerializer(matched_user).data,
-                'match_type': 'current_user'
-            })
-        
-        # If no current users, try to find users who recently ended calls (within last 5 minutes)
-        recent_threshold = timezone.now() - timedelta(minutes=5)
-        recent_users = User.objects.filter(
-            is_online=True,
-            last_seen__gte=recent_threshold,
-            is_looking_for_call=False,
-            current_call__isnull=True
-        ).exclude(id=user.id)
-        
-        print(f"Recently active users: {recent_users.count()}")
-        for recent_user in recent_users:
-            print(f"  - {recent_user.username} (last seen: {recent_user.last_seen}, online: {recent_user.is_online})")
-        
-        if recent_users.exists():
-            # Pick a random recent user
-            matched_user = random.choice(recent_users)
-            
-            print(f"Matched {user.username} with {matched_user.username} (recent user)")
-            
-            # Create a new call for the matched user
-            matched_call = VideoCall.objects.create(initiator=matched_user)
-            matched_user.current_call = matched_call
-            matched_user.is_looking_for_call = False
-            matched_user.save()
-            
-            # Update both calls to connect them
-            with transaction.atomic():
-                user.current_call.participant = matched_user
-                user.current_call.status = 'active'
-                user.current_call.started_at = timezone.now()
-                user.current_call.save()
-                
-                matched_call.participant = user
-                matched_call.status = 'active'
-                matched_call.started_at = timezone.now()
-                matched_call.save()
-                
-                # Update user status
-                user.is_looking_for_call = False
-                user.save()
-            
-            serializer = VideoCallSerializer(user.current_call)
-            return Response({
-                'matched': True,
-                'call': serializer.data,
-                'matched_user': UserSerializer(matched_user).data,
-                'match_type': 'recent_user'
-            })
-        
-        # If still no match, try to find any online user (even if they're not looking)
-        online_users = User.objects.filter(
-            is_online=True
-        ).exclude(id=user.id)
-        
-        print(f"Online users: {online_users.count()}")
-        for online_user in online_users:
-            print(f"  - {online_user.username} (looking: {online_user.is_looking_for_call}, call: {online_user.current_call})")
-        
-        if online_users.exists():
-            # Pick a random online user
-            matched_user = random.choice(online_users)
-            
-            print(f"Matched {user.username} with {matched_user.username} (online user)")
-            
-            # If the matched user has a current call, end it first
-            if matched_user.current_call:
-                old_call = matched_user.current_call
-                old_call.status = 'ended'
-                old_call.ended_at = timezone.now()
-                old_call.save()
-                matched_user.current_call = None
-                matched_user.is_looking_for_call = False
-                matched_user.save()
-            
-            # Create a new call for the matched user
-            matched_call = VideoCall.objects.create(initiator=matched_user)
-            matched_user.current_call = matched_call
-            matched_user.is_looking_for_call = False
-            matched_user.save()
-            
-            # Update both calls to connect them
-            with transaction.atomic():
-                user.current_call.participant = matched_user
-                user.current_call.status = 'active'
-                user.current_call.started_at = timezone.now()
-                user.current_call.save()
-                
-                matched_call.participant = user
-                matched_call.status = 'active'
-                matched_call.started_at = timezone.now()
-                matched_call.save()
-                
-                # Update user status
-                user.is_looking_for_call = False
-                user.save()
-            
-            serializer = VideoCallSerializer(user.current_call)
-            return Response({
-                'matched': True,
-                'call': serializer.data,
-                'matched_user': UserSerializer(matched_user).data,
-                'match_type': 'online_user'
-            })
+        call = user.current_call
+        
+        # Another user may already have paired with us since the last request
+        if call.status == 'active' and call.participant_id:
+            return Response(match_payload(user, call.participant))
         
-        print(f"No users available for {user.username}")
-        return Response({'matched': False, 'message': 'No users available for matching'})
+        matched_user = find_match(user)
+        if matched_user is None:
+            logger.debug("No users available, queued", extra={'user_id': user.id, 'waiting': len(match_queue)})
+            return Response({'matched': False, 'message': 'No users available for matching'})
+        
+        logger.info("Matched users", extra={'user_id': user.id, 'partner_id': matched_user.id})
+        notify_match(user, matched_user)
+        return Response(match_payload(user, matched_user))
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -292,36 +155,19 @@ class SkipCallView(APIView):
     
     def post(self, request):
         user = request.user
-        print(f"User {user.username} skipping call")
+        logger.debug("Skipping call", extra={'user_id': user.id, 'call_id': user.current_call_id})
         
-        if not user.current_call:
+        if not user.current_call_id:
             return Response({'error': 'No active call found'}, status=status.HTTP_400_BAD_REQUEST)
         
-        call = user.current_call
-        
-        with transaction.atomic():
-            # Mark call as skipped
-            call.status = 'skipped'
-            call.ended_at = timezone.now()
-            call.save()
-            
-            # If there's a participant, also update their call
-            if call.participant:
-                participant_call = call.participant.current_call
-                if participant_call:
-                    participant_call.status = 'skipped'
-                    participant_call.ended_at = timezone.now()
-                    participant_call.save()
-                    
-                    # Reset participant's call status
-                    call.participant.current_call = None
-                    call.participant.is_looking_for_call = False
-                    call.participant.save()
-            
-            # Reset user's call status
-            user.current_call = None
-            user.is_looking_for_call = False
-            user.save()
+        match_queue.cancel(user.id)
+        try:
+            call = finish_call(user, 'skip')
+        except IllegalTransition as e:
+            # Already finished, most likely by the partner
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        if call.participant_id:
+            match_queue.cancel(call.participant_id)
         
         return Response({'status': 'skipped'})
 
@@ -332,55 +178,65 @@ class EndCallView(APIView):
     
     def post(self, request):
         user = request.user
-        print(f"User {user.username} ending call")
+        logger.debug("Ending call", extra={'user_id': user.id, 'call_id': user.current_call_id})
         
-        if not user.current_call:
+        if not user.current_call_id:
             return Response({'error': 'No active call found'}, status=status.HTTP_400_BAD_REQUEST)
         
-        call = user.current_call
-        
-        with transaction.atomic():
-            # Mark call as ended
-            call.status = 'ended'
-            call.ended_at = timezone.now()
-            if call.started_at:
-                call.duration = int((call.ended_at - call.started_at).total_seconds())
-            call.save()
-            
-            # If there's a participant, also update their call
-            if call.participant:
-                participant_call = call.participant.current_call
-                if participant_call:
-                    participant_call.status = 'ended'
-                    participant_call.ended_at = timezone.now()
-                    if participant_call.started_at:
-                        participant_call.duration = int((participant_call.ended_at - participant_call.started_at).total_seconds())
-                    participant_call.save()
-                    
-                    # Reset participant's call status
-                    call.participant.current_call = None
-                    call.participant.is_looking_for_call = False
-                    call.participant.save()
-            
-            # Reset user's call status
-            user.current_call = None
-            user.is_looking_for_call = False
-            user.save()
+        match_queue.cancel(user.id)
+        try:
+            call = finish_call(user, 'end')
+        except IllegalTransition as e:
+            # Already finished, most likely by the partner
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        if call.participant_id:
+            match_queue.cancel(call.participant_id)
         
         return Response({'status': 'ended'})
 
 
+@method_decorator(csrf_exempt, name='dispatch')
+class CallDetailView(APIView):
+    """Status and participants of a call, with ETag/304 for cheap polling"""
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, call_id):
+        user = request.user
+        
+        try:
+            call_id = uuid.UUID(call_id)
+        except ValueError:
+            return Response({'error': 'Call not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        # Read the stamp before the row: a change in between then only makes
+        # the ETag older than the data, never newer
+        etag, last_modified = poll_validators(request, call_id, 'state')
+        
+        try:
+            call = VideoCall.objects.select_related('initiator', 'participant').get(id=call_id)
+        except VideoCall.DoesNotExist:
+            return Response({'error': 'Call not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        if user.id not in (call.initiator_id, call.participant_id):
+            return Response({'error': 'Not authorized for this call'}, status=status.HTTP_403_FORBIDDEN)
+        
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+        
+        return with_validators(Response(call_data(call)), etag, last_modified)
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class SendMessageView(APIView):
     permission_classes = [IsAuthenticated]
     
-    def post(self, request):
+    def post(self, request, call_id):
         user = request.user
-        call_id = request.data.get('call_id')
         content = request.data.get('content')
         
-        if not call_id or not content:
-            return Response({'error': 'Call ID and content are required'}, status=status.HTTP_400_BAD_REQUEST)
+        if not content:
+            return Response({'error': 'Content is required'}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
             call = VideoCall.objects.get(id=call_id)
@@ -388,23 +244,34 @@ class SendMessageView(APIView):
             return Response({'error': 'Call not found'}, status=status.HTTP_404_NOT_FOUND)
         
         # Check if user is part of this call
-        if call.initiator != user and call.participant != user:
+        if user.id not in (call.initiator_id, call.participant_id):
             return Response({'error': 'Not authorized for this call'}, status=status.HTTP_403_FORBIDDEN)
         
-        # Create message
-        message = ChatMessage.objects.create(
-            call=call,
-            sender=user,
-            content=content
-        )
+        # Queue the message; it is written with the next batch
+        message, flush_now = chat_buffer.add(call.id, user.id, content)
+        if flush_now:
+            chat_buffer.flush()
+        message.call = call
+        message.sender = user
         
-        serializer = ChatMessageSerializer(message)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(message_data(message), status=status.HTTP_201_CREATED)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
 class GetMessagesView(APIView):
+    """Chat history of a call, oldest first, one page at a time.
+
+    Pass the returned ``next_cursor`` back as ``cursor`` to get the
+    following page, or to poll for messages sent since the last one seen.
+    ``since`` (an ISO 8601 time) does the same for clients that only kept
+    a timestamp.
+    
+    Messages sent in the last ``CHAT_CURSOR_LAG`` seconds may be returned
+    again by the next page (see ``next_cursor``); skip ids already seen.
+    """
     permission_classes = [IsAuthenticated]
+    page_size = 100
+    max_page_size = 500
     
     def get(self, request, call_id):
         user = request.user
@@ -415,12 +282,46 @@ class GetMessagesView(APIView):
             return Response({'error': 'Call not found'}, status=status.HTTP_404_NOT_FOUND)
         
         # Check if user is part of this call
-        if call.initiator != user and call.participant != user:
+        if user.id not in (call.initiator_id, call.participant_id):
             return Response({'error': 'Not authorized for this call'}, status=status.HTTP_403_FORBIDDEN)
         
-        messages = ChatMessage.objects.filter(call=call).order_by('timestamp')
-        serializer = ChatMessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        cursor = request.query_params.get('cursor')
+        since = request.query_params.get('since')
+        try:
+            after = decode_cursor(cursor) if cursor else None
+            since = parse_datetime(since) if since else None
+            limit = min(int(request.query_params.get('limit', self.page_size)), self.max_page_size)
+        except ValueError:
+            after = since = limit = None
+        if limit is None or limit < 1 or (request.query_params.get('since') and since is None):
+            return Response({'error': 'Invalid cursor, since or limit'}, status=status.HTTP_400_BAD_REQUEST)
+        if since is not None and timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        
+        # Make this process's queued messages visible before reading
+        if chat_buffer.has_pending(call.id):
+            chat_buffer.flush()
+        
+        etag, last_modified = poll_validators(request, call.id, 'messages')
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+        
+        messages, has_more = message_page(call.id, after=after, since=since, limit=limit)
+        page_cursor = next_cursor(messages, cursor)
+        settled = page_cursor == (encode_cursor(messages[-1]) if messages else cursor)
+        response = Response({
+            'results': messages_data(messages),
+            'next_cursor': page_cursor,
+            # Asking again before the cursor can pass this page would only repeat it
+            'has_more': has_more and settled
+        })
+        if not settled:
+            # The cursor and has_more change once the lag is over, without a
+            # new stamp, so a 304 mustn't keep this page
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return with_validators(response, etag, last_modified)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -436,11 +337,13 @@ class ClearMessagesView(APIView):
             return Response({'error': 'Call not found'}, status=status.HTTP_404_NOT_FOUND)
         
         # Check if user is part of this call
-        if call.initiator != user and call.participant != user:
+        if user.id not in (call.initiator_id, call.participant_id):
             return Response({'error': 'Not authorized for this call'}, status=status.HTTP_403_FORBIDDEN)
         
-        # Delete all messages for this call
+        # Delete all messages for this call, including queued ones
+        chat_buffer.discard_call(call.id)
         ChatMessage.objects.filter(call=call).delete()
+        call_versions.bump([call.id], 'messages')
         
         return Response({'status': 'messages_cleared'})
 
@@ -450,19 +353,23 @@ class ClearMessagesView(APIView):
 @csrf_exempt
 def user_logout(request):
     user = request.user
-    print(f"User {user.username} logging out")
-    user.is_online = False
-    user.last_seen = timezone.now()
-    user.is_looking_for_call = False
+    logger.debug("Logging out", extra={'user_id': user.id})
+    now = timezone.now()
     
-    # End current call if any
-    if user.current_call:
-        user.current_call.status = 'ended'
-        user.current_call.ended_at = timezone.now()
-        user.current_call.save()
-        user.current_call = None
+    match_queue.cancel(user.id)
+    presence.mark_offline(user.id, now)
+    
+    # End current call if any, the partner's too
+    if user.current_call_id:
+        try:
+            finish_call(user, 'end', now)
+        except IllegalTransition:
+            pass
     
-    user.save()
+    User.objects.filter(id=user.id).update(
+        is_online=False, last_seen=now, is_looking_for_call=False, current_call=None
+    )
+    user_cache.invalidate([user.id])
     
     return Response({'status': 'logged_out'})
 
@@ -472,20 +379,23 @@ def user_logout(request):
 @csrf_exempt
 def debug_users(request):
     """Debug endpoint to see all users"""
-    users = User.objects.all()
+    users = User.objects.filter(pooled=False).select_related('current_call').order_by('-id')
     user_data = []
     for user in users:
+        is_online, last_seen = presence.get(user)
         user_data.append({
             'id': user.id,
             'username': user.username,
-            'is_online': user.is_online,
+            'is_online': is_online,
             'is_looking_for_call': user.is_looking_for_call,
-            'last_seen': user.last_seen,
+            'last_seen': last_seen,
             'current_call': user.current_call.id if user.current_call else None,
             'current_call_status': user.current_call.status if user.current_call else None
         })
     
     return Response({
         'total_users': users.count(),
-        'users': user_data
+        'users': user_data,
+        'presence_expiry': presence_expiry.metrics(),
+        'account_pool': account_pool.metrics()
     })
@@ -0,0 +1,57 @@
+"""
+JSON encoding shared by the REST API and the WebSocket consumers.
+
+Uses orjson when it is installed and the standard library otherwise. Both
+write compact UTF-8 JSON, fall back to DRF's encoder for types they don't
+know (datetimes, lazy strings, querysets, ...) and escape U+2028/U+2029,
+so the bytes match what DRF's ``JSONRenderer`` produces for the payloads
+this app sends. ``BACKEND`` says which one is in use.
+"""
+
+import json
+
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = JSONEncoder()
+
+if orjson is not None:
+    BACKEND = 'orjson'
+    # Datetimes go through DRF's encoder so they render exactly as before
+    _OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def _dumps(data):
+        return orjson.dumps(data, default=_encoder.default, option=_OPTIONS)
+
+    def loads(data):
+        """Decode JSON from ``str`` or ``bytes``; raises ``ValueError`` if invalid"""
+        return orjson.loads(data)
+else:
+    BACKEND = 'json'
+
+    def _dumps(data):
+        return json.dumps(
+            data, cls=JSONEncoder, ensure_ascii=False, allow_nan=False, separators=(',', ':')
+        ).encode()
+
+    def loads(data):
+        """Decode JSON from ``str`` or ``bytes``; raises ``ValueError`` if invalid"""
+        return json.loads(data)
+
+
+def dumps(data):
+    """Encode ``data`` as compact JSON, returning UTF-8 bytes"""
+    encoded = _dumps(data)
+    # Keep the output a strict JavaScript subset, as DRF does
+    if b'\xe2\x80\xa8' in encoded or b'\xe2\x80\xa9' in encoded:
+        encoded = encoded.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return encoded
+
+
+def dumps_text(data):
+    """Encode ``data`` as compact JSON, returning ``str`` for text frames"""
+    return dumps(data).decode()
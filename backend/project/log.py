@@ -0,0 +1,69 @@
+"""
+Logging helpers used by the ``LOGGING`` setting.
+
+Code logs through ``logging.getLogger(__name__)`` with %-style arguments, so
+messages below the configured level are never formatted. Context goes in
+``extra`` and is rendered as ``key=value`` pairs (or JSON) by
+``StructuredFormatter``.
+"""
+
+import json
+import logging
+import random
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def parse_levels(value):
+    """Parse ``"users.consumers=INFO,users.matchmaking=DEBUG"`` into a dict"""
+    levels = {}
+    for item in value.split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+class StructuredFormatter(logging.Formatter):
+    """One line per record: time, level, logger, message and extra fields"""
+
+    def __init__(self, json_output=False, **kwargs):
+        super().__init__(**kwargs)
+        self.json_output = json_output
+
+    def format(self, record):
+        fields = {
+            key: value for key, value in vars(record).items()
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_')
+        }
+        message = record.getMessage()
+        if self.json_output:
+            line = json.dumps({
+                'time': self.formatTime(record),
+                'level': record.levelname,
+                'logger': record.name,
+                'message': message,
+                **fields,
+            }, default=str)
+        else:
+            context = ' '.join(f'{key}={value}' for key, value in fields.items())
+            line = f'{self.formatTime(record)} {record.levelname} {record.name} {message}'
+            if context:
+                line = f'{line} {context}'
+        if record.exc_info:
+            line = f'{line}\n{self.formatException(record.exc_info)}'
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a ``rate`` fraction of DEBUG records; higher levels all pass"""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        return random.random() < self.rate
@@ -2,6 +2,8 @@ import os
 from pathlib import Path
 from dotenv import load_dotenv
 
+from project.log import parse_levels
+
 # Load environment variables
 load_dotenv()
 
@@ -148,8 +150,19 @@ AUTH_USER_MODEL = 'users.User'
 
 # REST Framework settings
 REST_FRAMEWORK = {
+    # Same JSON as DRF's own renderer/parser, encoded with orjson when installed
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # SimpleJWT, with the user loaded through the per-worker user cache
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -164,6 +177,18 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': True,
 }
 
+# Users resolved from access tokens are cached in each worker for up to
+# USER_CACHE_TTL seconds, USER_CACHE_SIZE at most (0 disables the cache)
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+
+# Each worker keeps up to ACCOUNT_POOL_SIZE anonymous users created ahead of
+# time for signups (0 disables the pool), adding at most
+# ACCOUNT_POOL_BATCH_SIZE every ACCOUNT_POOL_REFILL_INTERVAL seconds
+ACCOUNT_POOL_SIZE = int(os.environ.get('ACCOUNT_POOL_SIZE', 0))
+ACCOUNT_POOL_BATCH_SIZE = int(os.environ.get('ACCOUNT_POOL_BATCH_SIZE', 100))
+ACCOUNT_POOL_REFILL_INTERVAL = float(os.environ.get('ACCOUNT_POOL_REFILL_INTERVAL', 1))
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
@@ -198,11 +223,124 @@ CSRF_EXEMPT_URLS = [
     r'^/api/.*$',
 ]
 
-# Channels settings - Use in-memory for both dev and production
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+# Matchmaking backend: 'memory' pairs users from an in-process queue (one
+# worker), 'database' claims partners with SELECT ... FOR UPDATE SKIP LOCKED
+# so several workers can share one waiting pool. Setting REDIS_URL means
+# several workers, so it defaults to 'database' then
+MATCHMAKING_BACKEND = os.environ.get('MATCHMAKING_BACKEND', 'database' if os.environ.get('REDIS_URL') else 'memory')
+
+# How the memory backend picks a partner: 'random' (uniform, O(1)) or 'fifo'
+MATCHMAKING_ORDER = os.environ.get('MATCHMAKING_ORDER', 'random')
+
+# Seconds between batched writes of heartbeat presence to the user table
+# (0 writes through on every heartbeat)
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get('PRESENCE_FLUSH_INTERVAL', 5))
+
+# Users without a heartbeat for PRESENCE_TIMEOUT seconds are marked offline
+# and their calls ended; sweeps run every PRESENCE_SWEEP_INTERVAL seconds
+# (0 disables them; run manage.py expire_presence instead)
+PRESENCE_TIMEOUT = int(os.environ.get('PRESENCE_TIMEOUT', 90))
+PRESENCE_SWEEP_INTERVAL = int(os.environ.get('PRESENCE_SWEEP_INTERVAL', 30))
+
+# Chat messages are written in batches: every CHAT_FLUSH_INTERVAL seconds or
+# once CHAT_BATCH_SIZE are queued; senders wait once CHAT_MAX_PENDING are
+CHAT_FLUSH_INTERVAL = float(os.environ.get('CHAT_FLUSH_INTERVAL', 1))
+CHAT_BATCH_SIZE = int(os.environ.get('CHAT_BATCH_SIZE', 200))
+CHAT_MAX_PENDING = int(os.environ.get('CHAT_MAX_PENDING', 5000))
+
+# History cursors stay CHAT_CURSOR_LAG seconds behind the newest message, so
+# they never pass one another worker hasn't written yet; keep it above
+# CHAT_FLUSH_INTERVAL
+CHAT_CURSOR_LAG = float(os.environ.get('CHAT_CURSOR_LAG', CHAT_FLUSH_INTERVAL + 1))
+
+# ICE candidates a client trickles within ICE_BATCH_WINDOW seconds are sent
+# to the peer as one webrtc_signals frame (0 relays each one on its own)
+ICE_BATCH_WINDOW = float(os.environ.get('ICE_BATCH_WINDOW', 0))
+
+# Channels settings - in-memory by default, which only works with a single
+# worker. Set REDIS_URL to share channels and groups between workers and
+# machines; a comma-separated list of URLs shards groups across the nodes.
+CHANNEL_LAYER_CONFIG = {
+    'capacity': int(os.environ.get('CHANNEL_LAYER_CAPACITY', 100)),
+    'expiry': int(os.environ.get('CHANNEL_LAYER_EXPIRY', 60)),
+    'group_expiry': int(os.environ.get('CHANNEL_LAYER_GROUP_EXPIRY', 86400)),
+}
+
+REDIS_URLS = [url.strip() for url in os.environ.get('REDIS_URL', '').split(',') if url.strip()]
+
+if REDIS_URLS:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': REDIS_URLS,
+                **CHANNEL_LAYER_CONFIG,
+            },
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': CHANNEL_LAYER_CONFIG,
+        }
+    }
+
+# Cache - holds the per-call version stamps behind ETags on polled
+# endpoints, so it must be shared between workers: Redis when REDIS_URL is
+# set (the first URL), per-process memory otherwise
+if REDIS_URLS:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URLS[0],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
+
+# Logging - DEBUG output is off unless asked for, so hot paths don't pay
+# for it in production. LOG_LEVELS sets the level of any logger, e.g.
+# "users.consumers=DEBUG,users.matchmaking=INFO"; LOG_SAMPLE_RATE keeps
+# only that fraction of DEBUG records; LOG_JSON=True emits JSON lines.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO' if DEBUG else 'WARNING').upper()
+LOG_LEVELS = parse_levels(os.environ.get('LOG_LEVELS', ''))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sample': {
+            '()': 'project.log.SamplingFilter',
+            'rate': float(os.environ.get('LOG_SAMPLE_RATE', 1.0)),
+        },
+    },
+    'formatters': {
+        'structured': {
+            '()': 'project.log.StructuredFormatter',
+            'json_output': os.environ.get('LOG_JSON', 'False').lower() == 'true',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'structured',
+            'filters': ['sample'],
+        },
+    },
+    'loggers': {
+        name: {
+            'handlers': ['console'],
+            'level': LOG_LEVELS.get(name, LOG_LEVEL),
+            'propagate': False,
+        }
+        # Any logger can be named, e.g. django.db.backends=DEBUG to see SQL
+        for name in dict.fromkeys(['users', 'api', *LOG_LEVELS])
+    },
 }
 
 # Security settings for production
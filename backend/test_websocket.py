@@ -1,18 +1,41 @@
 #!/usr/bin/env python
 """
 Simple test to verify WebSocket connections work
+
+With no arguments, connects one client to a video call room and prints the
+reply. With --pairs, runs a signaling load test instead: every pair opens
+two video call sockets and two matching sockets, replays an SDP
+offer/answer exchange and a burst of ICE candidates from each side, and
+reports connect time, signal round-trip latency, memory per connection and
+dropped messages.
+
+    # Against a local server (daphne project.asgi:application)
+    python test_websocket.py --pairs 1000 --server-pid <daphne pid>
+
+    # In-process against the ASGI app and a throwaway test database
+    python test_websocket.py --pairs 1000 --in-process
+
+Add --binary to speak the MessagePack subprotocol instead of JSON.
 """
+import argparse
 import asyncio
-import websockets
 import json
+import os
+import resource
+import time
+import uuid
+from collections import defaultdict
+
 
 async def test_websocket():
+    import websockets
+
     uri = "ws://127.0.0.1:8000/ws/video_call/test-room/?username=test_user"
-    
+
     try:
         async with websockets.connect(uri) as websocket:
             print("WebSocket connected successfully!")
-            
+
             # Send a test message
             test_message = {
                 "type": "chat_message",
@@ -20,16 +43,437 @@ async def test_websocket():
                     "content": "Hello from test client!"
                 }
             }
-            
+
             await websocket.send(json.dumps(test_message))
             print("Test message sent!")
-            
+
             # Wait for response
             response = await websocket.recv()
             print(f"Received response: {response}")
-            
+
     except Exception as e:
         print(f"WebSocket test failed: {e}")
 
+
+# A browser-sized offer: audio and video sections with the usual codecs
+SDP_OFFER = "\r\n".join([
+    "v=0",
+    "o=- 4611731400430051336 2 IN IP4 127.0.0.1",
+    "s=-",
+    "t=0 0",
+    "a=group:BUNDLE 0 1",
+    "a=extmap-allow-mixed",
+    "a=msid-semantic: WMS stream",
+    "m=audio 9 UDP/TLS/RTP/SAVPF 111 63 103 104 9 0 8 106 105 13 110 112 113 126",
+    "c=IN IP4 0.0.0.0",
+    "a=rtcp:9 IN IP4 0.0.0.0",
+    "a=ice-ufrag:{ufrag}",
+    "a=ice-pwd:{pwd}",
+    "a=ice-options:trickle",
+    "a=fingerprint:sha-256 " + ":".join(["7B"] * 32),
+    "a=setup:{setup}",
+    "a=mid:0",
+    "a=extmap:1 urn:ietf:params:rtp-hdrext:ssrc-audio-level",
+    "a=extmap:2 http://www.webrtc.org/experiments/rtp-hdrext/abs-send-time",
+    "a=extmap:3 http://www.ietf.org/id/draft-holmer-rmcat-transport-wide-cc-extensions-01",
+    "a=sendrecv",
+    "a=msid:stream audio-track",
+    "a=rtcp-mux",
+    "a=rtpmap:111 opus/48000/2",
+    "a=rtcp-fb:111 transport-cc",
+    "a=fmtp:111 minptime=10;useinbandfec=1",
+    "a=rtpmap:63 red/48000/2",
+    "a=rtpmap:103 ISAC/16000",
+    "a=rtpmap:104 ISAC/32000",
+    "a=rtpmap:9 G722/8000",
+    "a=rtpmap:0 PCMU/8000",
+    "a=rtpmap:8 PCMA/8000",
+    "a=ssrc:1001 cname:load",
+    "m=video 9 UDP/TLS/RTP/SAVPF 96 97 102 122 127 121 125 107 108 109 124 120 39 40",
+    "c=IN IP4 0.0.0.0",
+    "a=rtcp:9 IN IP4 0.0.0.0",
+    "a=ice-ufrag:{ufrag}",
+    "a=ice-pwd:{pwd}",
+    "a=ice-options:trickle",
+    "a=fingerprint:sha-256 " + ":".join(["7B"] * 32),
+    "a=setup:{setup}",
+    "a=mid:1",
+    "a=extmap:14 urn:ietf:params:rtp-hdrext:toffset",
+    "a=extmap:13 urn:3gpp:video-orientation",
+    "a=sendrecv",
+    "a=msid:stream video-track",
+    "a=rtcp-mux",
+    "a=rtcp-rsize",
+    "a=rtpmap:96 VP8/90000",
+    "a=rtcp-fb:96 goog-remb",
+    "a=rtcp-fb:96 transport-cc",
+    "a=rtcp-fb:96 ccm fir",
+    "a=rtcp-fb:96 nack",
+    "a=rtcp-fb:96 nack pli",
+    "a=rtpmap:97 rtx/90000",
+    "a=fmtp:97 apt=96",
+    "a=rtpmap:102 H264/90000",
+    "a=fmtp:102 level-asymmetry-allowed=1;packetization-mode=1;profile-level-id=42001f",
+    "a=rtpmap:39 AV1/90000",
+    "a=ssrc-group:FID 2001 2002",
+    "a=ssrc:2001 cname:load",
+    "a=ssrc:2002 cname:load",
+    "",
+])
+
+
+def session_description(kind):
+    sdp = SDP_OFFER.format(
+        ufrag=uuid.uuid4().hex[:4],
+        pwd=uuid.uuid4().hex[:24],
+        setup='actpass' if kind == 'offer' else 'active',
+    )
+    return {'type': kind, 'sdp': sdp}
+
+
+def ice_candidate(index):
+    return {
+        'type': 'ice-candidate',
+        'candidate': {
+            'candidate': (
+                f'candidate:{842163049 + index} 1 udp {2122260223 - index} '
+                f'192.168.1.{index % 250 + 2} {50000 + index} typ host generation 0 '
+                f'ufrag abcd network-id 1 network-cost 10'
+            ),
+            'sdpMid': str(index % 2),
+            'sdpMLineIndex': index % 2,
+        }
+    }
+
+
+def percentile(samples, percent):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def rss_kb(pid):
+    """Resident memory of a process in KiB, from /proc where available"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    if pid == os.getpid():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None
+
+
+class Framing:
+    """Encodes frames as JSON text, or as MessagePack for binary sockets"""
+
+    def __init__(self, binary):
+        self.binary = binary
+        self.bytes_received = 0
+        if binary:
+            from users import protocol
+            self.protocol = protocol
+            self.subprotocols = [protocol.SUBPROTOCOL]
+        else:
+            self.subprotocols = None
+
+    def encode(self, data):
+        return self.protocol.pack(data) if self.binary else json.dumps(data)
+
+    def decode(self, frame):
+        self.bytes_received += len(frame)
+        if isinstance(frame, bytes):
+            return self.protocol.unpack(frame)
+        return json.loads(frame)
+
+
+class RemoteSocket(Framing):
+    """A client socket to a running server"""
+
+    def __init__(self, base_url, binary=False):
+        super().__init__(binary)
+        self.base_url = base_url
+
+    async def connect(self, path):
+        import websockets
+        self.websocket = await websockets.connect(self.base_url + path, max_size=None, subprotocols=self.subprotocols)
+
+    async def send_json(self, data):
+        await self.websocket.send(self.encode(data))
+
+    async def receive_json(self, timeout=None):
+        return self.decode(await asyncio.wait_for(self.websocket.recv(), timeout))
+
+    async def close(self):
+        await self.websocket.close()
+
+
+class InProcessSocket(Framing):
+    """A client socket talking straight to the ASGI app in this process"""
+
+    def __init__(self, application, binary=False):
+        super().__init__(binary)
+        self.application = application
+
+    async def connect(self, path):
+        from channels.testing import WebsocketCommunicator
+        self.communicator = WebsocketCommunicator(self.application, path, subprotocols=self.subprotocols)
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise ConnectionError(f'Connection to {path} refused')
+
+    async def send_json(self, data):
+        if self.binary:
+            await self.communicator.send_to(bytes_data=self.encode(data))
+        else:
+            await self.communicator.send_to(text_data=self.encode(data))
+
+    async def receive_json(self, timeout=None):
+        # The communicator cancels the app when its own timeout fires, so
+        # time out around it instead
+        return self.decode(await asyncio.wait_for(self.communicator.receive_from(timeout=None), timeout))
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class Peer:
+    """One side of a call: a video call socket and a matching socket"""
+
+    def __init__(self, name, make_socket):
+        self.name = name
+        self.video = make_socket()
+        self.matching = make_socket()
+        self.signals = asyncio.Queue()
+        self.frames = 0
+        self.reader = None
+
+    async def read_signals(self):
+        # Older servers echo our own signals back; keep the peer's only.
+        # Batched ICE candidates arrive together as webrtc_signals
+        while True:
+            data = await self.video.receive_json()
+            if data.get('type') == 'webrtc_signal':
+                messages = [data.get('message') or {}]
+            elif data.get('type') == 'webrtc_signals':
+                messages = data['messages']
+            else:
+                continue
+            self.frames += 1
+            arrived = time.perf_counter()
+            for message in messages:
+                if message.get('from') != self.name:
+                    await self.signals.put((arrived, message))
+
+    async def send_signal(self, message, seq):
+        await self.video.send_json({
+            'type': 'webrtc_signal',
+            'message': {**message, 'from': self.name, 'seq': seq, 'sent_at': time.perf_counter()},
+        })
+
+
+class LoadTest:
+    def __init__(self, make_socket, pairs, concurrency, burst, timeout):
+        self.make_socket = make_socket
+        self.pairs = pairs
+        self.burst = burst
+        self.timeout = timeout
+        self.limit = asyncio.Semaphore(concurrency)
+        self.run_id = uuid.uuid4().hex[:8]
+        self.latencies = defaultdict(list)
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.first_error = None
+
+    async def timed(self, name, awaitable):
+        started = time.perf_counter()
+        result = await awaitable
+        self.latencies[name].append((time.perf_counter() - started) * 1000)
+        return result
+
+    async def connect_pair(self, index):
+        async with self.limit:
+            room = f'load-{self.run_id}-{index}'
+            peers = [Peer(f'load_{self.run_id}_{index}_{side}', self.make_socket) for side in 'ab']
+            try:
+                for peer in peers:
+                    await self.timed('connect_video_call', self.connect(
+                        peer.video, f'/ws/video_call/{room}/?username={peer.name}'
+                    ))
+                    await self.timed('connect_matching', self.connect(
+                        peer.matching, f'/ws/matching/?username={peer.name}'
+                    ))
+                    peer.reader = asyncio.ensure_future(peer.read_signals())
+            except Exception as e:
+                self.failed += 1
+                self.first_error = self.first_error or repr(e)
+                return None
+            return peers
+
+    async def connect(self, socket, path):
+        await socket.connect(path)
+        await socket.receive_json(self.timeout)
+
+    async def expect(self, peer, count):
+        """Wait for ``count`` signals from the other side, recording latency"""
+        received = []
+        deadline = time.perf_counter() + self.timeout
+        while len(received) < count:
+            try:
+                arrived, message = await asyncio.wait_for(peer.signals.get(), deadline - time.perf_counter())
+            except asyncio.TimeoutError:
+                break
+            self.latencies['signal_one_way'].append((arrived - message['sent_at']) * 1000)
+            received.append(message)
+        self.dropped += count - len(received)
+        return received
+
+    async def signal_pair(self, peers):
+        async with self.limit:
+            caller, callee = peers
+
+            await self.timed('looking_for_match', self.look_for_match(caller))
+
+            # Offer -> answer round trip, as seen by the caller
+            started = time.perf_counter()
+            await caller.send_signal(session_description('offer'), 0)
+            self.sent += 1
+            if await self.expect(callee, 1):
+                await callee.send_signal(session_description('answer'), 0)
+                self.sent += 1
+                if await self.expect(caller, 1):
+                    self.latencies['offer_answer_rtt'].append((time.perf_counter() - started) * 1000)
+
+            # Both sides trickle their candidates at once
+            for peer in peers:
+                for seq in range(self.burst):
+                    await peer.send_signal(ice_candidate(seq), seq + 1)
+            self.sent += 2 * self.burst
+            await asyncio.gather(self.expect(caller, self.burst), self.expect(callee, self.burst))
+
+    async def look_for_match(self, peer):
+        await peer.matching.send_json({'type': 'looking_for_match'})
+        while (await peer.matching.receive_json(self.timeout))['type'] != 'user_looking_for_match':
+            pass
+
+    async def close_pair(self, peers):
+        for peer in peers:
+            peer.reader.cancel()
+            await peer.video.close()
+            await peer.matching.close()
+
+    async def run(self, server_pid):
+        rss_before = rss_kb(server_pid)
+        started = time.perf_counter()
+        pairs = [p for p in await asyncio.gather(*map(self.connect_pair, range(self.pairs))) if p]
+        connect_seconds = time.perf_counter() - started
+        rss_connected = rss_kb(server_pid)
+
+        started = time.perf_counter()
+        await asyncio.gather(*map(self.signal_pair, pairs))
+        signal_seconds = time.perf_counter() - started
+
+        frames = sum(peer.frames for peers in pairs for peer in peers)
+        frame_bytes = sum(peer.video.bytes_received for peers in pairs for peer in peers)
+        for peers in pairs:
+            await self.close_pair(peers)
+
+        connections = len(pairs) * 4
+        memory = None
+        if rss_before is not None and rss_connected is not None and connections:
+            memory = round((rss_connected - rss_before) / connections, 2)
+        return {
+            'pairs': self.pairs,
+            'connections': connections,
+            'failed_pairs': self.failed,
+            'first_error': self.first_error,
+            'connect_seconds': round(connect_seconds, 3),
+            'signal_seconds': round(signal_seconds, 3),
+            'signals_sent': self.sent,
+            'signals_dropped': self.dropped,
+            'signal_frames_received': frames,
+            'video_bytes_received': frame_bytes,
+            'memory_per_connection_kb': memory,
+            'latency_ms': {
+                name: {
+                    'count': len(samples),
+                    'p50': round(percentile(samples, 50), 3),
+                    'p95': round(percentile(samples, 95), 3),
+                    'p99': round(percentile(samples, 99), 3),
+                }
+                for name, samples in self.latencies.items()
+            },
+        }
+
+
+def print_report(results):
+    print(
+        f"{results['pairs']} pairs, {results['connections']} connections "
+        f"({results['failed_pairs']} pairs failed to connect)"
+    )
+    if results['first_error']:
+        print(f"first connect error: {results['first_error']}")
+    print(f"connected in {results['connect_seconds']}s, signaled in {results['signal_seconds']}s")
+    print(
+        f"signals sent {results['signals_sent']}, dropped {results['signals_dropped']}, "
+        f"frames received {results['signal_frames_received']} ({results['video_bytes_received']} bytes)"
+    )
+    print(f"memory per connection: {results['memory_per_connection_kb']} KiB")
+    print(f"{'latency':<20} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, row in results['latency_ms'].items():
+        print(f"{name:<20} {row['count']:>7} {row['p50']:>9.2f} {row['p95']:>9.2f} {row['p99']:>9.2f}")
+
+
+def run_in_process(args):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+    import django
+    django.setup()
+
+    from channels.routing import URLRouter
+    from users.management.testdb import throwaway_database
+    from users.middleware import WebSocketAuthMiddleware
+    from users.routing import websocket_urlpatterns
+
+    application = WebSocketAuthMiddleware(URLRouter(websocket_urlpatterns))
+    load = LoadTest(lambda: InProcessSocket(application, args.binary), args.pairs, args.concurrency, args.burst, args.timeout)
+    with throwaway_database():
+        return asyncio.run(load.run(os.getpid()))
+
+
+def run_remote(args):
+    load = LoadTest(lambda: RemoteSocket(args.url, args.binary), args.pairs, args.concurrency, args.burst, args.timeout)
+    return asyncio.run(load.run(args.server_pid))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WebSocket smoke and signaling load test')
+    parser.add_argument('--pairs', type=int, help='Run the load test with this many calls')
+    parser.add_argument('--in-process', action='store_true', help='Drive the ASGI app in this process')
+    parser.add_argument('--url', default='ws://127.0.0.1:8000', help='Server to connect to')
+    parser.add_argument('--server-pid', type=int, help='Server process to sample memory from')
+    parser.add_argument('--concurrency', type=int, default=200, help='Pairs connecting or signaling at once')
+    parser.add_argument('--burst', type=int, default=10, help='ICE candidates sent by each side')
+    parser.add_argument('--timeout', type=float, default=10, help='Seconds to wait for any one message')
+    parser.add_argument('--binary', action='store_true', help='Use the MessagePack subprotocol')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    if not args.pairs:
+        asyncio.run(test_websocket())
+        return
+
+    results = run_in_process(args) if args.in_process else run_remote(args)
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
 if __name__ == "__main__":
-    asyncio.run(test_websocket()) 
\ No newline at end of file
+    main()
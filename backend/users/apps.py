@@ -4,3 +4,20 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        # Registers the signal handlers that keep the user cache fresh
+        from . import auth  # noqa: F401
+
+
+def start_background_threads():
+    """Start the threads every server worker runs next to its requests.
+
+    Called from the ASGI and WSGI entry points rather than ``ready()``, so
+    management commands and tests don't start them.
+    """
+    from .expiry import presence_expiry
+    from .pool import account_pool
+
+    presence_expiry.start()
+    account_pool.start()
@@ -0,0 +1,109 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import User
+
+
+class UserCache:
+    """Recently authenticated users by id, kept for at most ``ttl`` seconds.
+
+    Access tokens are verified without the database, so this is what keeps
+    authentication query-free: a user row is loaded once and then served
+    from memory until the entry expires, is pushed out by the ``max_size``
+    most recently used ones, or is invalidated. An entry also belongs to
+    the token (``jti``) it was loaded for; another token reloads the row.
+
+    ``invalidate`` must be called whenever a user's row changes, which the
+    ``post_save``/``post_delete`` handlers below do for ``save()``; code
+    that changes users with ``update()`` calls it itself. Besides dropping
+    the entry here it bumps a per-user version stamp in the default cache,
+    which every lookup checks, so workers sharing a Redis cache drop their
+    copy too. Callers get a copy of the cached user, free to change and save.
+    """
+
+    def __init__(self, max_size, ttl, cache_alias='default'):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self.hits = 0
+        self.misses = 0
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def key(self, user_id):
+        return f'user_version:{user_id}'
+
+    def version(self, user_id):
+        key = self.key(user_id)
+        stamp = self.cache.get(key)
+        if stamp is None:
+            self.cache.add(key, time.time_ns(), self.ttl)
+            stamp = self.cache.get(key)
+        return stamp
+
+    def get_user(self, user_id, token_id=None):
+        """The user with this id, raising ``User.DoesNotExist`` if there is none"""
+        # Read the stamp before the row, so a change in between can't be
+        # cached under the new stamp
+        stamp = self.version(user_id)
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                user, expires, entry_stamp, entry_token_id = entry
+                if expires >= time.monotonic() and entry_stamp == stamp and entry_token_id == token_id:
+                    self._users.move_to_end(user_id)
+                    self.hits += 1
+                    return copy.copy(user)
+                del self._users[user_id]
+            self.misses += 1
+
+        user = User.objects.get(id=user_id)
+        if self.max_size:
+            with self._lock:
+                self._users[user_id] = (copy.copy(user), time.monotonic() + self.ttl, stamp, token_id)
+                while len(self._users) > self.max_size:
+                    self._users.popitem(last=False)
+        return user
+
+    def invalidate(self, user_ids):
+        """Forget users whose row changed, here and (on commit) everywhere"""
+        user_ids = list(user_ids)
+        self._discard(user_ids)
+
+        def bump():
+            self._discard(user_ids)
+            stamp = time.time_ns()
+            self.cache.set_many({self.key(user_id): stamp for user_id in user_ids}, self.ttl)
+
+        transaction.on_commit(bump)
+
+    def _discard(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+user_cache = UserCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, created=False, **kwargs):
+    # A new user can't be cached anywhere yet
+    if not created:
+        user_cache.invalidate([instance.id])
@@ -0,0 +1,168 @@
+import atexit
+import base64
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ChatMessage
+from .versions import call_versions
+
+logger = logging.getLogger(__name__)
+
+
+class ChatBuffer:
+    """Write-behind buffer for chat messages.
+
+    Messages are relayed to the room straight away and only queued here; a
+    background thread writes them with ``bulk_create`` every
+    ``flush_interval`` seconds, or as soon as ``batch_size`` are waiting.
+    Each message gets its id and timestamp when it is queued, so clients can
+    use them before the row exists and history keeps the order they were
+    sent in.
+
+    At most ``max_pending`` messages are held; past that ``add`` reports
+    that the caller should flush itself, which pushes back on whoever is
+    sending faster than the DB can take it. With a ``flush_interval`` of 0
+    there is no thread and it always does. ``add`` itself never touches the
+    database or the cache, so async code can call it directly. Whatever is
+    left is written on shutdown.
+    """
+
+    def __init__(self, flush_interval, batch_size=200, max_pending=5000):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher = None
+
+    def add(self, call_id, sender_id, content):
+        """Queue a message, returning it and whether to flush now.
+
+        When told to, the caller should run ``flush()`` (from a thread, in
+        async code) before sending more.
+        """
+        message = ChatMessage(call_id=call_id, sender_id=sender_id, content=content, timestamp=timezone.now())
+        with self._lock:
+            self._pending.append(message)
+            pending = len(self._pending)
+
+        # No stamp bump yet: the message can't be read before it is written,
+        # and flush() bumps then
+        if not self.flush_interval:
+            return message, True
+        if self._flusher is None:
+            self._start_flusher()
+        if pending >= self.batch_size:
+            self._wake.set()
+        return message, pending >= self.max_pending
+
+    def has_pending(self, call_id):
+        with self._lock:
+            return any(str(message.call_id) == str(call_id) for message in self._pending)
+
+    def discard_call(self, call_id):
+        """Drop queued messages of a call, e.g. when its history is cleared"""
+        with self._lock:
+            self._pending = [message for message in self._pending if str(message.call_id) != str(call_id)]
+
+    def flush(self):
+        """Write every queued message, returning how many were written"""
+        with self._lock:
+            messages, self._pending = self._pending, []
+        if not messages:
+            return 0
+
+        # Other workers may have served these calls' history without the
+        # queued messages; a new stamp makes their clients fetch it again
+        try:
+            ChatMessage.objects.bulk_create(messages, batch_size=self.batch_size)
+            call_versions.bump({message.call_id for message in messages}, 'messages')
+            return len(messages)
+        except Exception:
+            logger.exception("Error writing chat batch, retrying one by one", extra={'size': len(messages)})
+
+        # One bad row (e.g. a call deleted meanwhile) mustn't lose the batch
+        written = 0
+        for message in messages:
+            try:
+                message.save(force_insert=True)
+                written += 1
+            except Exception:
+                logger.exception("Dropping chat message", extra={'call_id': message.call_id})
+        call_versions.bump({message.call_id for message in messages}, 'messages')
+        return written
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._run_flusher, name='chat-flusher', daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def _run_flusher(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Error flushing chat messages")
+            finally:
+                connections.close_all()
+
+
+def encode_cursor(message):
+    """Opaque cursor for the position just after ``message``"""
+    raw = f'{message.timestamp.isoformat()}|{message.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """``(timestamp, id)`` from a cursor, raising ``ValueError`` if it is malformed"""
+    timestamp, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(timestamp), uuid.UUID(message_id)
+
+
+def next_cursor(messages, cursor=None, now=None):
+    """Cursor to pass back after a page of ``messages`` read with ``cursor``.
+
+    Each message's timestamp is set when it is queued, but its row only
+    appears once that worker writes its batch, so a message another worker
+    still holds can sort before rows already visible. The cursor therefore
+    only moves past messages older than ``CHAT_CURSOR_LAG`` seconds; newer
+    ones come again in the next page, and clients skip ids they have.
+    """
+    settled = (now or timezone.now()) - timedelta(seconds=settings.CHAT_CURSOR_LAG)
+    for message in reversed(messages):
+        if message.timestamp <= settled:
+            return encode_cursor(message)
+    return cursor
+
+
+def message_page(call_id, after=None, since=None, limit=100):
+    """Up to ``limit`` messages of a call in ``(timestamp, id)`` order.
+
+    ``after`` is a decoded cursor and returns only messages past it;
+    ``since`` is a datetime and returns messages sent after it. Returns
+    ``(messages, has_more)``. Senders are loaded in the same query.
+    """
+    messages = ChatMessage.objects.filter(call_id=call_id)
+    if after is not None:
+        timestamp, message_id = after
+        messages = messages.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id))
+    if since is not None:
+        messages = messages.filter(timestamp__gt=since)
+    messages = list(messages.select_related('sender').order_by('timestamp', 'id')[:limit + 1])
+    return messages[:limit], len(messages) > limit
+
+
+chat_buffer = ChatBuffer(settings.CHAT_FLUSH_INTERVAL, settings.CHAT_BATCH_SIZE, settings.CHAT_MAX_PENDING)
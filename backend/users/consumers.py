@@ -1,221 +1,434 @@
-import json
+import asyncio
+import logging
 import uuid
-from channels.generic.websocket import AsyncWebsocketConsumer
+from urllib.parse import parse_qs
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import Q
+from project import codec
 from .models import VideoCall, User
+from . import protocol
+from .chat import chat_buffer
+from .matchmaking import find_match, match_event, notify_match
+from .registry import frame_event, matching_registry, send_to_user
 
 User = get_user_model()
 
-class VideoCallConsumer(AsyncWebsocketConsumer):
+logger = logging.getLogger(__name__)
+
+
+class CodecConsumer(AsyncJsonWebsocketConsumer):
+    """Base for the app's consumers: JSON frames encoded with ``project.codec``.
+
+    Subclasses handle decoded messages in ``receive_json`` and send with
+    ``send_json``; frames that can't be decoded go to ``receive_invalid``.
+    Clients that offer ``protocol.SUBPROTOCOL`` get binary MessagePack
+    frames instead (``binary`` is true); subclasses don't see the difference.
+    """
+
+    binary = False
+
+    async def accept(self, subprotocol=None):
+        offered = self.scope.get('subprotocols', ())
+        if subprotocol is None and protocol.AVAILABLE and protocol.SUBPROTOCOL in offered:
+            subprotocol = protocol.SUBPROTOCOL
+        self.binary = subprotocol == protocol.SUBPROTOCOL
+        await super().accept(subprotocol)
+
+    @classmethod
+    async def decode_json(cls, text_data):
+        return codec.loads(text_data)
+
+    @classmethod
+    async def encode_json(cls, content):
+        return codec.dumps_text(content)
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        data = text_data if text_data is not None else bytes_data
+        try:
+            if bytes_data is not None and self.binary:
+                content = protocol.unpack(bytes_data)
+            else:
+                content = await self.decode_json(data)
+        except (TypeError, ValueError):
+            await self.receive_invalid(data)
+            return
+        await self.receive_json(content, **kwargs)
+
+    async def send_json(self, content, close=False):
+        if self.binary:
+            await self.send(bytes_data=protocol.pack(content), close=close)
+        else:
+            await super().send_json(content, close)
+
+    async def receive_invalid(self, data):
+        """Called with a frame that couldn't be decoded"""
+
+    def get_username(self):
+        """The name shown to peers: the token's user, else ``?username=``
+
+        Only anonymous sockets may pick their name, so an authenticated
+        client can't pass itself off as someone else.
+        """
+        user = self.scope.get('user')
+        if user is not None and user.is_authenticated:
+            return user.username
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        return params.get('username', [None])[0]
+
+    async def group_send_frame(self, group, frame, text=True, binary=False):
+        """Send ``frame`` to every socket in ``group``, encoding it only once"""
+        await self.channel_layer.group_send(group, frame_event(frame, text, binary))
+
+    async def forward_frame(self, event):
+        """Send a frame encoded by whoever sent the event, unchanged if possible"""
+        if event.get('exclude') == self.channel_name:
+            return
+        if self.binary and 'bytes' in event:
+            await self.send(bytes_data=event['bytes'])
+        elif self.binary:
+            # Nobody expected a binary receiver, or sent by a worker without msgpack
+            await self.send(bytes_data=protocol.pack(codec.loads(event['text'])))
+        elif 'text' in event:
+            await self.send(text_data=event['text'])
+        else:
+            await self.send(text_data=codec.dumps_text(protocol.unpack(event['bytes'])))
+
+
+class VideoCallConsumer(CodecConsumer):
     async def connect(self):
-        print(f"WebSocket connect attempt: {self.scope}")
-        
         # Accept the connection immediately
         await self.accept()
-        print(f"WebSocket connection accepted")
         
         # Get call ID from URL
         self.call_id = self.scope['url_route']['kwargs']['call_id']
         self.room_group_name = f'video_call_{self.call_id}'
         
-        # Get username from query params
-        query_string = self.scope.get('query_string', b'').decode()
-        username = None
-        if query_string:
-            params = dict(param.split('=') for param in query_string.split('&') if '=' in param)
-            username = params.get('username')
-        
-        self.username = username
-        print(f"User {username} connecting to call {self.call_id}")
+        self.user = self.scope.get('user')
+        self.username = username = self.get_username()
+        # Whether this user's chat is saved, looked up on their first message
+        self.chat_sender_id = None
+        self.chat_sender_checked = False
+        self.peer_channels = set()
+        # Peers whose clients use binary frames
+        self.binary_peers = set()
+        self.ice_batch = []
+        self.ice_batch_timer = None
+        logger.debug("Video call socket connected", extra={'username': username, 'call_id': self.call_id})
         
         # Join the room group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        print(f"Added to room group: {self.room_group_name}")
+        
+        # Introduce ourselves; sockets already in the room reply directly,
+        # so signals can go to the peer's channel instead of the group
+        await self.channel_layer.group_send(self.room_group_name, {
+            'type': 'peer.join',
+            'channel': self.channel_name,
+            'binary': self.binary
+        })
         
         # Send connection confirmation
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'connection_established',
             'message': 'Connected to video call',
             'call_id': self.call_id,
             'username': self.username
-        }))
+        })
 
     async def disconnect(self, close_code):
-        print(f"WebSocket disconnect: {close_code}")
+        logger.debug("Video call socket disconnected", extra={'username': self.username, 'code': close_code})
+        
+        # Deliver candidates still waiting for their batch window
+        await self.send_ice_batch()
         
         # Leave the room group
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        await self.channel_layer.group_send(self.room_group_name, {
+            'type': 'peer.leave',
+            'channel': self.channel_name
+        })
 
-    async def receive(self, text_data):
-        print(f"Received message: {text_data}")
+    async def receive_json(self, data):
+        message_type = data.get('type')
         
-        try:
-            data = json.loads(text_data)
-            message_type = data.get('type')
-            
-            if message_type == 'webrtc_signal':
-                # Forward WebRTC signaling to other users in the room
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'webrtc_signal',
-                        'message': data.get('message'),
-                        'username': self.username
-                    }
-                )
-            elif message_type == 'chat_message':
-                # Handle chat messages
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'chat_message',
-                        'message': data.get('message'),
-                        'username': self.username
-                    }
-                )
+        if message_type == 'webrtc_signal':
+            # Forward WebRTC signaling to the other side of the call only
+            message = data.get('message')
+            if settings.ICE_BATCH_WINDOW and isinstance(message, dict) and message.get('type') == 'ice-candidate':
+                self.queue_ice_candidate(message)
             else:
-                # Echo back unknown message types
-                await self.send(text_data=json.dumps({
-                    'type': 'echo',
-                    'message': data
-                }))
-                
-        except json.JSONDecodeError:
-            print(f"Invalid JSON received: {text_data}")
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': 'Invalid JSON format'
-            }))
+                # Candidates already queued go first, keeping the peer's order
+                await self.send_ice_batch()
+                await self.send_to_peers({
+                    'type': 'webrtc_signal',
+                    'message': message,
+                    'username': self.username
+                })
+        elif message_type == 'chat_message':
+            # Relay first, then queue the message for a batched write
+            text_peers = not self.peer_channels or self.peer_channels - self.binary_peers
+            await self.group_send_frame(self.room_group_name, {
+                'type': 'chat_message',
+                'message': data.get('message'),
+                'username': self.username
+            }, text=not self.binary or bool(text_peers), binary=self.binary or bool(self.binary_peers))
+            await self.persist_chat_message(data.get('message'))
+        else:
+            # Echo back unknown message types
+            await self.send_json({
+                'type': 'echo',
+                'message': data
+            })
+
+    async def receive_invalid(self, data):
+        logger.info("Invalid JSON on video call socket", extra={'username': self.username, 'size': len(data or '')})
+        await self.send_json({
+            'type': 'error',
+            'message': 'Invalid JSON format'
+        })
+
+    async def send_to_peers(self, frame):
+        """Send ``frame`` to the other sockets in the call, not back to us"""
+        if not self.peer_channels:
+            # No peer has answered yet: go through the room, skipping us
+            event = frame_event(frame)
+            event['exclude'] = self.channel_name
+            await self.channel_layer.group_send(self.room_group_name, event)
+            return
+        # Encode once per format the peers use
+        events = {}
+        for channel in list(self.peer_channels):
+            binary = channel in self.binary_peers
+            if binary not in events:
+                events[binary] = frame_event(frame, text=not binary, binary=binary)
+            await self.channel_layer.send(channel, events[binary])
+
+    def queue_ice_candidate(self, message):
+        """Hold a candidate until the batch window closes"""
+        self.ice_batch.append(message)
+        if self.ice_batch_timer is None:
+            self.ice_batch_timer = asyncio.ensure_future(self.send_ice_batch_later())
+
+    async def send_ice_batch_later(self):
+        await asyncio.sleep(settings.ICE_BATCH_WINDOW)
+        self.ice_batch_timer = None
+        await self.send_ice_batch()
 
+    async def send_ice_batch(self):
+        """Send the queued candidates, as one frame if there are several"""
+        if self.ice_batch_timer is not None:
+            self.ice_batch_timer.cancel()
+            self.ice_batch_timer = None
+        messages, self.ice_batch = self.ice_batch, []
+        if len(messages) == 1:
+            await self.send_to_peers({
+                'type': 'webrtc_signal',
+                'message': messages[0],
+                'username': self.username
+            })
+        elif messages:
+            await self.send_to_peers({
+                'type': 'webrtc_signals',
+                'messages': messages,
+                'username': self.username
+            })
+
+    @database_sync_to_async
+    def get_chat_sender_id(self):
+        """The user's id if they are part of this call, so their chat is saved"""
+        if not (self.user and self.user.is_authenticated):
+            return None
+        try:
+            call_id = uuid.UUID(self.call_id)
+        except ValueError:
+            return None
+        is_member = VideoCall.objects.filter(
+            Q(initiator_id=self.user.id) | Q(participant_id=self.user.id),
+            id=call_id
+        ).exists()
+        return self.user.id if is_member else None
+
+    async def persist_chat_message(self, message):
+        if not self.chat_sender_checked:
+            self.chat_sender_id = await self.get_chat_sender_id()
+            self.chat_sender_checked = True
+        if self.chat_sender_id is None:
+            return
+        content = message.get('content') if isinstance(message, dict) else message
+        if not isinstance(content, str) or not content:
+            return
+        _, flush_now = chat_buffer.add(self.call_id, self.chat_sender_id, content)
+        if flush_now:
+            await database_sync_to_async(chat_buffer.flush)()
+
+    # Events sent field by field rather than as an encoded frame, e.g. by
+    # workers still running an older release
     async def webrtc_signal(self, event):
         """Handle WebRTC signaling messages"""
-        print(f"Forwarding WebRTC signal: {event}")
-        
         # Send to WebSocket
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'webrtc_signal',
             'message': event['message'],
             'username': event['username']
-        }))
+        })
 
     async def chat_message(self, event):
         """Handle chat messages"""
-        print(f"Forwarding chat message: {event}")
-        
         # Send to WebSocket
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'chat_message',
             'message': event['message'],
             'username': event['username']
-        }))
+        })
+
+    async def peer_join(self, event):
+        """Another socket joined the room; tell it our channel"""
+        if event['channel'] == self.channel_name:
+            return
+        self.add_peer(event)
+        await self.channel_layer.send(event['channel'], {
+            'type': 'peer.present',
+            'channel': self.channel_name,
+            'binary': self.binary
+        })
+
+    async def peer_present(self, event):
+        """A socket already in the room answered our introduction"""
+        self.add_peer(event)
+
+    async def peer_leave(self, event):
+        self.peer_channels.discard(event['channel'])
+        self.binary_peers.discard(event['channel'])
+
+    def add_peer(self, event):
+        self.peer_channels.add(event['channel'])
+        # Peers on older workers don't say; they get text, which is converted
+        if event.get('binary'):
+            self.binary_peers.add(event['channel'])
 
     async def user_join(self, event):
         """Handle user join notifications"""
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'user_join',
             'username': event['username']
-        }))
+        })
 
     async def user_leave(self, event):
         """Handle user leave notifications"""
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'user_leave',
             'username': event['username']
-        }))
+        })
 
 
-class MatchingConsumer(AsyncWebsocketConsumer):
+class MatchingConsumer(CodecConsumer):
     async def connect(self):
-        print(f"Matching WebSocket connect attempt: {self.scope}")
-        
         # Accept the connection immediately
         await self.accept()
-        print(f"Matching WebSocket connection accepted")
         
-        # Get username from query params
-        query_string = self.scope.get('query_string', b'').decode()
-        username = None
-        if query_string:
-            params = dict(param.split('=') for param in query_string.split('&') if '=' in param)
-            username = params.get('username')
+        self.user = self.scope.get('user')
+        self.username = username = self.get_username()
+        self.user_id = None
         
-        self.username = username
-        self.room_group_name = 'matching_room'
-        
-        print(f"User {username} connecting to matching room")
-        
-        # Join the matching room
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+        # Register our channel so events can be addressed to this user only
+        if self.user and self.user.is_authenticated:
+            self.user_id = self.user.id
+            await matching_registry.register(self.channel_layer, self.user_id, self.channel_name)
+        logger.debug("Matching socket connected", extra={'username': username, 'user_id': self.user_id})
         
         # Send connection confirmation
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'connection_established',
             'message': 'Connected to matching service',
             'username': self.username
-        }))
+        })
 
     async def disconnect(self, close_code):
-        print(f"Matching WebSocket disconnect: {close_code}")
+        logger.debug("Matching socket disconnected", extra={'user_id': self.user_id, 'code': close_code})
         
-        # Leave the matching room
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        if self.user_id is not None:
+            await matching_registry.unregister(self.channel_layer, self.user_id, self.channel_name)
 
-    async def receive(self, text_data):
-        print(f"Received matching message: {text_data}")
+    async def receive_json(self, data):
+        message_type = data.get('type')
         
-        try:
-            data = json.loads(text_data)
-            message_type = data.get('type')
+        if message_type == 'looking_for_match':
+            # Queue the user; the match is pushed to both users' channels
+            if self.user_id is not None:
+                await self.register_for_match()
             
-            if message_type == 'looking_for_match':
-                # Notify other users that this user is looking for a match
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'user_looking_for_match',
-                        'username': self.username,
-                        'call_id': data.get('call_id')
-                    }
-                )
-            elif message_type == 'match_found':
-                # Notify users about a match
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'match_found',
-                        'call_id': data.get('call_id'),
-                        'matched_users': data.get('matched_users', [])
-                    }
-                )
-                
-        except json.JSONDecodeError:
-            print(f"Invalid JSON received: {text_data}")
+            # Confirm to this user only
+            await self.user_looking_for_match({
+                'username': self.username,
+                'call_id': data.get('call_id')
+            })
+        elif message_type == 'match_found':
+            # Notify only the users named in the match
+            matched_users = data.get('matched_users', [])
+            event = frame_event({
+                'type': 'match_found',
+                'call_id': data.get('call_id'),
+                'matched_users': matched_users,
+                'call': None,
+                'matched_user': None,
+                'match_type': None
+            })
+            for user_id in await self.get_user_ids(matched_users):
+                await send_to_user(self.channel_layer, user_id, event)
+
+    async def receive_invalid(self, data):
+        logger.info("Invalid JSON on matching socket", extra={'user_id': self.user_id, 'size': len(data or '')})
+
+    @database_sync_to_async
+    def get_user_ids(self, usernames):
+        return list(User.objects.filter(username__in=usernames[:2]).values_list('id', flat=True))
+
+    @database_sync_to_async
+    def register_for_match(self):
+        """Queue the user for matching, or push the match if one is found"""
+        user = User.objects.select_related('current_call__participant').get(id=self.user_id)
+        call = user.current_call
+        if not call:
+            return
+        
+        # Already paired by another user; send the result to this user too
+        if call.status == 'active' and call.participant_id:
+            async_to_sync(send_to_user)(
+                self.channel_layer,
+                user.id,
+                match_event(user, call.participant)
+            )
+            return
+        
+        matched_user = find_match(user)
+        if matched_user is not None:
+            logger.info("Matched users", extra={'user_id': user.id, 'partner_id': matched_user.id})
+            notify_match(user, matched_user)
 
     async def user_looking_for_match(self, event):
         """Handle user looking for match notifications"""
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'user_looking_for_match',
             'username': event['username'],
             'call_id': event['call_id']
-        }))
+        })
 
     async def match_found(self, event):
         """Handle match found notifications"""
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'match_found',
             'call_id': event['call_id'],
-            'matched_users': event['matched_users']
-        })) 
\ No newline at end of file
+            'matched_users': event.get('matched_users', []),
+            'call': event.get('call'),
+            'matched_user': event.get('matched_user'),
+            'match_type': event.get('match_type')
+        })
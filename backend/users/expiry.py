@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .auth import user_cache
+from .lifecycle import LIVE, transition
+from .matchmaking import match_queue
+from .models import User, VideoCall
+from .presence import presence
+from .versions import call_versions
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceExpiry:
+    """Marks users offline once their heartbeat is older than ``timeout``.
+
+    A sweep ends the calls of expired users (and detaches their partners),
+    clears their matching state and drops them from the match queue, all
+    with a handful of UPDATEs per batch of ``batch_size`` users. Sweeps run
+    on their own thread every ``interval`` seconds once ``start()`` is
+    called (an interval of 0 disables them), or on demand with
+    ``manage.py expire_presence``.
+    """
+
+    def __init__(self, timeout, interval, batch_size=500):
+        self.timeout = timeout
+        self.interval = interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sweeper = None
+        self.sweeps = 0
+        self.expired_total = 0
+        self.last_expired = 0
+        self.last_sweep_at = None
+        self.last_sweep_seconds = 0.0
+
+    def start(self):
+        """Start sweeping every ``interval`` seconds in the background"""
+        if not self.interval:
+            return
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._run_sweeper, name='presence-expiry', daemon=True)
+        self._sweeper.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+        self._sweeper = None
+        self._stop.clear()
+
+    def _run_sweeper(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Error expiring stale users")
+            finally:
+                connections.close_all()
+
+    def sweep(self):
+        """Expire every stale user, returning how many were expired"""
+        with self._lock:
+            started = time.monotonic()
+
+            # Live heartbeats from this process must be on the rows first
+            presence.flush()
+
+            now = timezone.now()
+            cutoff = now - timedelta(seconds=self.timeout)
+            stale_ids = list(User.objects.filter(
+                is_online=True,
+                last_seen__lt=cutoff
+            ).values_list('id', flat=True))
+
+            expired = 0
+            for start in range(0, len(stale_ids), self.batch_size):
+                expired += self._expire(stale_ids[start:start + self.batch_size], cutoff, now)
+
+            self.sweeps += 1
+            self.expired_total += expired
+            self.last_expired = expired
+            self.last_sweep_at = now
+            self.last_sweep_seconds = time.monotonic() - started
+            if expired:
+                logger.info("Expired stale users", extra=self.metrics())
+            return expired
+
+    def _expire(self, user_ids, cutoff, now):
+        # Skip anyone who sent a heartbeat since the rows were read
+        user_ids = [
+            user_id for user_id in user_ids
+            if presence.last_seen(user_id) is None or presence.last_seen(user_id) < cutoff
+        ]
+        if not user_ids:
+            return 0
+
+        with transaction.atomic():
+            # Re-check and lock the rows first: a heartbeat another worker
+            # flushes meanwhile keeps that user, and their call, alive
+            user_ids = list(User.objects.select_for_update().filter(
+                id__in=user_ids, is_online=True, last_seen__lt=cutoff
+            ).values_list('id', flat=True))
+            if not user_ids:
+                return 0
+            User.objects.filter(id__in=user_ids).update(is_online=False, is_looking_for_call=False, current_call=None)
+            user_cache.invalidate(user_ids)
+
+            call_ids = list(VideoCall.objects.filter(
+                Q(initiator_id__in=user_ids) | Q(participant_id__in=user_ids),
+                status__in=LIVE
+            ).values_list('id', flat=True))
+            if call_ids:
+                transition(VideoCall.objects.filter(id__in=call_ids), 'end', ended_at=now)
+                call_versions.bump_on_commit(call_ids, 'state')
+                # Partners of expired users go back to having no call
+                partner_ids = list(User.objects.filter(current_call_id__in=call_ids).values_list('id', flat=True))
+                User.objects.filter(id__in=partner_ids).update(current_call=None, is_looking_for_call=False)
+                user_cache.invalidate(partner_ids)
+
+        for user_id in user_ids:
+            match_queue.cancel(user_id)
+        presence.discard(user_ids)
+        return len(user_ids)
+
+    def metrics(self):
+        return {
+            'timeout': self.timeout,
+            'sweeps': self.sweeps,
+            'expired_total': self.expired_total,
+            'last_expired': self.last_expired,
+            'last_sweep_at': self.last_sweep_at,
+            'last_sweep_seconds': round(self.last_sweep_seconds, 4),
+        }
+
+
+presence_expiry = PresenceExpiry(settings.PRESENCE_TIMEOUT, settings.PRESENCE_SWEEP_INTERVAL)
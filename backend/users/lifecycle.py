@@ -0,0 +1,146 @@
+"""
+Call lifecycle: the states a ``VideoCall`` goes through and the moves
+allowed between them.
+
+    waiting --match--> active
+    waiting, active --skip--> skipped
+    waiting, active --end--> ended
+
+Every move is a conditional UPDATE (``... WHERE status IN`` the states it
+may start from), so when two requests race on the same call only one of
+them applies and the other is told with ``IllegalTransition``. The users'
+``current_call``/``is_looking_for_call`` are updated in the same
+transaction, and their cached copies and the calls' poll stamps are
+invalidated when it commits.
+"""
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .auth import user_cache
+from .models import User, VideoCall
+from .presence import presence
+from .versions import call_versions
+
+WAITING = 'waiting'
+ACTIVE = 'active'
+ENDED = 'ended'
+SKIPPED = 'skipped'
+
+LIVE = (WAITING, ACTIVE)
+
+# Transition name -> (states it may start from, state it leads to)
+TRANSITIONS = {
+    'match': ((WAITING,), ACTIVE),
+    'skip': (LIVE, SKIPPED),
+    'end': (LIVE, ENDED),
+}
+
+
+class IllegalTransition(Exception):
+    """The call (or user) isn't in a state the transition can start from"""
+
+
+def transition(calls, name, **fields):
+    """Move the calls in ``calls`` that may take transition ``name``.
+
+    Calls in any other state are left alone. Returns how many moved.
+    """
+    sources, target = TRANSITIONS[name]
+    return calls.filter(status__in=sources).update(status=target, **fields)
+
+
+def create_call(user):
+    """Open a waiting call for ``user``, who must not be in a call.
+
+    One INSERT and one conditional UPDATE of the user, which fails (and
+    rolls the INSERT back) if another request gave them a call meanwhile.
+    """
+    with transaction.atomic():
+        call = VideoCall.objects.create(initiator=user)
+        attached = User.objects.filter(id=user.id, current_call__isnull=True).update(
+            current_call=call, is_looking_for_call=True
+        )
+        if not attached:
+            raise IllegalTransition('User is already in a call')
+        user_cache.invalidate([user.id])
+
+    user.current_call = call
+    user.is_looking_for_call = True
+    return call
+
+
+def match_calls(user, partner_id, partner_call_id, now):
+    """Move the waiting calls of ``user`` and their partner to active.
+
+    Must run inside a transaction. Returns ``False`` (and leaves the
+    transaction marked for rollback) if either call was no longer waiting.
+    """
+    call = user.current_call
+    claimed = (
+        transition(VideoCall.objects.filter(id=partner_call_id, participant__isnull=True), 'match',
+                   participant_id=user.id, started_at=now) == 1
+        and transition(VideoCall.objects.filter(id=call.id, participant__isnull=True), 'match',
+                       participant_id=partner_id, started_at=now) == 1
+    )
+    if not claimed:
+        transaction.set_rollback(True)
+        return False
+
+    User.objects.filter(id__in=[user.id, partner_id]).update(is_looking_for_call=False)
+    user_cache.invalidate([user.id, partner_id])
+    call_versions.bump_on_commit([call.id, partner_call_id], 'state')
+    presence.touch(user.id, now)
+    presence.touch(partner_id, now)
+    call.participant_id = partner_id
+    call.status = ACTIVE
+    call.started_at = now
+    user.is_looking_for_call = False
+    return True
+
+
+def finish_call(user, name, now=None):
+    """Skip or end (``name``) the user's current call and their partner's.
+
+    One SELECT for both calls, one UPDATE moving them and one detaching
+    both users. Raises ``IllegalTransition`` if the user's call isn't live
+    any more, e.g. because the partner ended it first. Returns the call.
+    """
+    now = now or timezone.now()
+    # The user's own call, and the partner's, which points back at the user
+    calls = list(VideoCall.objects.filter(
+        Q(id=user.current_call_id) | Q(participant_id=user.id, status__in=LIVE)
+    ))
+    call = next((call for call in calls if call.id == user.current_call_id), None)
+    if call is None or call.status not in TRANSITIONS[name][0]:
+        raise IllegalTransition(f'Call is already {call.status}' if call else 'No active call found')
+
+    partner_calls = [
+        other for other in calls
+        if other is not call and call.participant_id and other.initiator_id == call.participant_id
+    ]
+    call_ids = [call.id] + [other.id for other in partner_calls]
+    user_ids = [user.id] + [other.initiator_id for other in partner_calls]
+
+    fields = {'ended_at': now}
+    # Both calls of a pair start at the same moment
+    if name == 'end' and call.started_at:
+        fields['duration'] = int((now - call.started_at).total_seconds())
+
+    with transaction.atomic():
+        if transition(VideoCall.objects.filter(id__in=call_ids), name, **fields) != len(call_ids):
+            raise IllegalTransition('Call changed while it was being updated')
+        # A partner who already moved on to a new call keeps it
+        User.objects.filter(id__in=user_ids, current_call_id__in=call_ids).update(
+            current_call=None, is_looking_for_call=False
+        )
+        user_cache.invalidate(user_ids)
+        call_versions.bump_on_commit(call_ids, 'state')
+
+    call.status = TRANSITIONS[name][1]
+    for field, value in fields.items():
+        setattr(call, field, value)
+    user.current_call = None
+    user.is_looking_for_call = False
+    return call
@@ -0,0 +1,87 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIClient
+
+from users.auth import user_cache
+from users.management.commands.bench_matchmaking import API, QueryCounter, Recorder
+from users.management.testdb import throwaway_database
+
+# Requests a client in a call keeps making: heartbeat, call state poll and
+# chat history poll. None of them change the user's row.
+HOT_STEPS = [
+    ('status', 'post', '/status/'),
+    ('call_detail', 'get', '/call/{call_id}/'),
+    ('get_messages', 'get', '/call/{call_id}/messages/'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the hot REST endpoints for N users against a throwaway test "
+        "database, first with the authentication user cache disabled (one "
+        "user query per request, like plain JWTAuthentication) and then "
+        "enabled, and report the queries and latency saved per request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help='Simulated users')
+        parser.add_argument('--rounds', type=int, default=5, help='Requests per user and endpoint')
+
+    def handle(self, *args, **options):
+        if not settings.USER_CACHE_SIZE:
+            raise CommandError('USER_CACHE_SIZE is 0; nothing to compare')
+
+        results = {}
+        with throwaway_database():
+            clients = [self.register() for _ in range(options['users'])]
+            for label, size in (('uncached', 0), ('cached', settings.USER_CACHE_SIZE)):
+                user_cache.max_size = size
+                user_cache.clear()
+                user_cache.hits = user_cache.misses = 0
+                results[label] = self.run_round(clients, options['rounds'])
+                results[label]['hit_rate'] = user_cache.hits / max(1, user_cache.hits + user_cache.misses)
+        user_cache.max_size = settings.USER_CACHE_SIZE
+
+        uncached, cached = results['uncached'], results['cached']
+        self.stdout.write(f"users={options['users']} rounds={options['rounds']} hit rate={cached['hit_rate']:.1%}")
+        self.stdout.write(
+            f"{'step':<14} {'queries off':>11} {'queries on':>10} {'saved':>6} {'p50 off ms':>10} {'p50 on ms':>9}"
+        )
+        for step, _, _ in HOT_STEPS:
+            off, on = uncached['steps'][step], cached['steps'][step]
+            self.stdout.write(
+                f"{step:<14} {off['queries_per_request']:>11.2f} {on['queries_per_request']:>10.2f} "
+                f"{off['queries_per_request'] - on['queries_per_request']:>6.2f} "
+                f"{off['p50_ms']:>10.2f} {on['p50_ms']:>9.2f}"
+            )
+        self.stdout.write(f"total: {uncached['seconds']:.3f}s uncached, {cached['seconds']:.3f}s cached")
+
+    def register(self):
+        client = APIClient()
+        data = client.post(f'{API}/register/').json()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {data['access_token']}")
+        response = client.post(f'{API}/call/create/')
+        if response.status_code != 201:
+            raise CommandError(f'Creating a call failed: {response.status_code}')
+        client.call_id = response.json()['id']
+        return client
+
+    def run_round(self, clients, rounds):
+        recorder = Recorder()
+        queries = QueryCounter()
+        queries.start()
+        started = time.perf_counter()
+        try:
+            for _ in range(rounds):
+                for client in clients:
+                    for step, method, path in HOT_STEPS:
+                        query_count = queries.count
+                        sent = time.perf_counter()
+                        response = getattr(client, method)(API + path.format(call_id=client.call_id))
+                        seconds = time.perf_counter() - sent
+                        recorder.add(step, seconds, queries.count - query_count, response.status_code == 200)
+        finally:
+            queries.stop()
+        return {'steps': recorder.summary(), 'seconds': time.perf_counter() - started}
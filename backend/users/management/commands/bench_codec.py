@@ -0,0 +1,142 @@
+import json
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from project import codec
+from users import protocol
+from users.management.commands.bench_serializers import sample_objects
+from users.serializers import call_data, messages_data, user_data
+
+# The media sections of a typical browser offer, repeated per m-line
+MEDIA_SECTION = [
+    'c=IN IP4 0.0.0.0',
+    'a=rtcp:9 IN IP4 0.0.0.0',
+    'a=ice-ufrag:Hx3b',
+    'a=ice-pwd:0Zq2c1kS6n9Yp4vT8wR3mL7e',
+    'a=ice-options:trickle',
+    'a=fingerprint:sha-256 ' + ':'.join(['7B'] * 32),
+    'a=setup:actpass',
+    'a=extmap:1 urn:ietf:params:rtp-hdrext:ssrc-audio-level',
+    'a=extmap:2 http://www.webrtc.org/experiments/rtp-hdrext/abs-send-time',
+    'a=extmap:3 http://www.ietf.org/id/draft-holmer-rmcat-transport-wide-cc-extensions-01',
+    'a=sendrecv',
+    'a=rtcp-mux',
+] + [f'a=rtpmap:{96 + i} VP8/90000\r\na=rtcp-fb:{96 + i} nack pli' for i in range(10)]
+
+
+def sample_frames():
+    """Signaling frames as they go over the video call socket"""
+    sdp = '\r\n'.join(
+        ['v=0', 'o=- 4611731400430051336 2 IN IP4 127.0.0.1', 's=-', 't=0 0', 'a=group:BUNDLE 0 1']
+        + ['m=audio 9 UDP/TLS/RTP/SAVPF 111 63 9 0 8'] + MEDIA_SECTION
+        + ['m=video 9 UDP/TLS/RTP/SAVPF 96 97 98 99'] + MEDIA_SECTION
+    )
+    offer = {'type': 'webrtc_signal', 'message': {'type': 'offer', 'sdp': sdp}, 'username': 'User_ALICE1'}
+    candidate = {'type': 'webrtc_signal', 'message': {'type': 'ice-candidate', 'candidate': {
+        'candidate': 'candidate:842163049 1 udp 1677729535 203.0.113.5 54400 typ srflx raddr 10.0.0.5 '
+                     'rport 54400 generation 0 ufrag Hx3b network-cost 999',
+        'sdpMid': '0',
+        'sdpMLineIndex': 0,
+    }}, 'username': 'User_ALICE1'}
+    chat = {'type': 'chat_message', 'message': {'content': 'hello   world ✓'}, 'username': 'User_BOB234'}
+    return offer, candidate, chat
+
+
+class Command(BaseCommand):
+    help = (
+        "Time JSON encoding and decoding of SDP offers, ICE candidates and the "
+        "hot REST payloads with project.codec against the standard library, "
+        "and check the codec writes the same bytes as DRF's JSONRenderer. "
+        "Then compare frame size and encode/decode time of the JSON and "
+        "MessagePack WebSocket framings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=5000, help='Iterations per timing')
+
+    def handle(self, *args, **options):
+        users, calls, messages = sample_objects()
+        offer, candidate, chat = sample_frames()
+        payloads = [
+            ('sdp offer', offer),
+            ('ice candidate', candidate),
+            ('chat frame', chat),
+            ('match payload', {'matched': True, 'call': call_data(calls[0]), 'matched_user': user_data(users[1])}),
+            ('50 messages', {'results': messages_data(messages), 'next_cursor': None, 'has_more': False}),
+        ]
+
+        renderer = JSONRenderer()
+        for name, payload in payloads:
+            if codec.dumps(payload) != renderer.render(payload):
+                raise CommandError(f'{name}: codec output differs from JSONRenderer')
+            if codec.loads(codec.dumps(payload)) != json.loads(renderer.render(payload)):
+                raise CommandError(f'{name}: codec does not round-trip')
+        self.stdout.write(self.style.SUCCESS(f'codec={codec.BACKEND}, output identical to JSONRenderer'))
+
+        number = options['number']
+        self.stdout.write(
+            f"{'payload':<14} {'bytes':>6} {'json enc':>9} {'codec enc':>10} {'json dec':>9} {'codec dec':>10}  (us)"
+        )
+        for name, payload in payloads:
+            encoded = codec.dumps(payload)
+            timings = [
+                lambda: renderer.render(payload),
+                lambda: codec.dumps(payload),
+                lambda: json.loads(encoded),
+                lambda: codec.loads(encoded),
+            ]
+            json_enc, codec_enc, json_dec, codec_dec = (
+                min(timeit.repeat(timing, number=number, repeat=3)) / number * 1e6 for timing in timings
+            )
+            self.stdout.write(
+                f'{name:<14} {len(encoded):>6} {json_enc:>9.2f} {codec_enc:>10.2f} {json_dec:>9.2f} {codec_dec:>10.2f}'
+            )
+
+        if not protocol.AVAILABLE:
+            self.stdout.write('msgpack is not installed, skipping the binary framing')
+            return
+        self.compare_framings(number, [
+            ('sdp offer', offer),
+            ('ice candidate', candidate),
+            ('8 candidates', {
+                'type': 'webrtc_signals',
+                'messages': [candidate['message']] * 8,
+                'username': candidate['username'],
+            }),
+            ('chat frame', chat),
+            ('match found', {
+                'type': 'match_found',
+                'call_id': str(calls[0].id),
+                'matched_users': [],
+                'call': call_data(calls[0]),
+                'matched_user': user_data(users[1]),
+                'match_type': 'random',
+            }),
+        ])
+
+    def compare_framings(self, number, frames):
+        for name, frame in frames:
+            if protocol.unpack(protocol.pack(frame)) != frame:
+                raise CommandError(f'{name}: MessagePack frame does not round-trip')
+
+        self.stdout.write(
+            f"{'frame':<14} {'json B':>7} {'mp B':>6} {'json enc':>9} {'mp enc':>7} {'json dec':>9} {'mp dec':>7}  (us)"
+        )
+        for name, frame in frames:
+            text = codec.dumps_text(frame)
+            packed = protocol.pack(frame)
+            timings = [
+                lambda: codec.dumps_text(frame),
+                lambda: protocol.pack(frame),
+                lambda: codec.loads(text),
+                lambda: protocol.unpack(packed),
+            ]
+            json_enc, mp_enc, json_dec, mp_dec = (
+                min(timeit.repeat(timing, number=number, repeat=3)) / number * 1e6 for timing in timings
+            )
+            self.stdout.write(
+                f'{name:<14} {len(text.encode()):>7} {len(packed):>6} '
+                f'{json_enc:>9.2f} {mp_enc:>7.2f} {json_dec:>9.2f} {mp_dec:>7.2f}'
+            )
@@ -0,0 +1,250 @@
+import json
+import subprocess
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from users.management.testdb import throwaway_database
+from users.middleware import WebSocketAuthMiddleware
+from users.routing import websocket_urlpatterns
+
+API = '/api/v1'
+
+
+def percentile(samples, percent):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class QueryCounter:
+    """Counts queries on every connection, whichever thread runs them.
+
+    Consumers do their DB work on a worker thread with its own connection,
+    which ``CaptureQueriesContext`` on this thread wouldn't see.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def start(self):
+        connection_created.connect(self.install)
+        for alias in connections:
+            self.install(connections[alias])
+
+    def stop(self):
+        connection_created.disconnect(self.install)
+        for alias in connections:
+            if self in connections[alias].execute_wrappers:
+                connections[alias].execute_wrappers.remove(self)
+
+
+class Recorder:
+    """Collects latency and query count samples per step"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, step, seconds, queries, ok=True):
+        self.latencies[step].append(seconds * 1000)
+        self.queries[step].append(queries)
+        if not ok:
+            self.errors[step] += 1
+
+    def summary(self):
+        return {
+            step: {
+                'requests': len(samples),
+                'errors': self.errors[step],
+                'p50_ms': round(percentile(samples, 50), 3),
+                'p95_ms': round(percentile(samples, 95), 3),
+                'p99_ms': round(percentile(samples, 99), 3),
+                'mean_ms': round(sum(samples) / len(samples), 3),
+                'queries_per_request': round(sum(self.queries[step]) / len(self.queries[step]), 2),
+            }
+            for step, samples in self.latencies.items()
+        }
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive register, create call, find match and end call for N simulated "
+        "users, over REST and over the matching WebSocket, against a throwaway "
+        "test database. Reports p50/p95/p99 latency, queries per request and "
+        "matches per second, and writes the results to a JSON file so runs "
+        "from different commits can be compared."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Simulated users (rounded up to an even number)')
+        parser.add_argument('--output', default='bench_matchmaking.json', help='Where to write the JSON results')
+        parser.add_argument('--backend', choices=['memory', 'database'], default=settings.MATCHMAKING_BACKEND)
+
+    def handle(self, *args, **options):
+        settings.MATCHMAKING_BACKEND = options['backend']
+        user_count = options['users'] + options['users'] % 2
+        if user_count < 2:
+            raise CommandError('Need at least two users')
+
+        self.recorder = Recorder()
+        self.queries = QueryCounter()
+        with throwaway_database():
+            self.queries.start()
+            try:
+                clients = [self.register() for _ in range(user_count)]
+                http = self.run_http_round(clients)
+                websocket = async_to_sync(self.run_websocket_round)(clients)
+            finally:
+                self.queries.stop()
+
+        results = {
+            'benchmark': 'matchmaking',
+            'commit': current_commit(),
+            'created_at': timezone.now().isoformat(),
+            'users': user_count,
+            'vendor': connection.vendor,
+            'matchmaking_backend': options['backend'],
+            'matchmaking_order': settings.MATCHMAKING_ORDER,
+            'steps': self.recorder.summary(),
+            'matching': {'http': http, 'websocket': websocket},
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+
+        self.write_report(results)
+        self.stdout.write(f"Results written to {options['output']}")
+
+    def request(self, step, client, path, expected=200):
+        query_count = self.queries.count
+        started = time.perf_counter()
+        response = client.post(f'{API}{path}')
+        seconds = time.perf_counter() - started
+        self.recorder.add(step, seconds, self.queries.count - query_count, response.status_code == expected)
+        return response
+
+    def register(self):
+        client = APIClient()
+        data = self.request('register', client, '/register/', expected=201).json()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {data['access_token']}")
+        client.username = data['user']['username']
+        client.token = data['access_token']
+        return client
+
+    def create_calls(self, clients):
+        for client in clients:
+            self.request('create_call', client, '/call/create/', expected=201)
+
+    def end_calls(self, clients, partners):
+        # Ending a call also ends the partner's, so only one side ends it
+        ended = set()
+        for client in clients:
+            if client.username not in ended:
+                self.request('end_call', client, '/call/end/')
+                ended.update((client.username, partners.get(client.username)))
+
+    def run_http_round(self, clients):
+        self.create_calls(clients)
+
+        partners = {}
+        started = time.perf_counter()
+        for client in clients:
+            data = self.request('find_match', client, '/call/find-match/').json()
+            if data.get('matched') and client.username not in partners:
+                partner = data['matched_user']['username']
+                partners[client.username] = partner
+                partners[partner] = client.username
+        seconds = time.perf_counter() - started
+
+        self.end_calls(clients, partners)
+        matches = len(partners) // 2
+        return {'matches': matches, 'seconds': round(seconds, 4), 'matches_per_second': round(matches / seconds, 1)}
+
+    async def run_websocket_round(self, clients):
+        await database_sync_to_async(self.create_calls)(clients)
+
+        application = WebSocketAuthMiddleware(URLRouter(websocket_urlpatterns))
+        sockets = []
+        for client in clients:
+            socket = WebsocketCommunicator(application, f'/ws/matching/?username={client.username}&token={client.token}')
+            connected, _ = await socket.connect()
+            if not connected:
+                raise CommandError(f'Matching socket refused for {client.username}')
+            await socket.receive_json_from()
+            sockets.append(socket)
+
+        # Each user asks for a match and waits for the acknowledgement, which
+        # is sent once the match (if any) has been pushed to both sockets
+        partners = {}
+        started = time.perf_counter()
+        for client, socket in zip(clients, sockets):
+            query_count = self.queries.count
+            sent = time.perf_counter()
+            await socket.send_json_to({'type': 'looking_for_match'})
+            while True:
+                message = await socket.receive_json_from(timeout=5)
+                if message['type'] == 'match_found':
+                    partner = message['matched_user']['username']
+                    partners[client.username] = partner
+                    partners[partner] = client.username
+                elif message['type'] == 'user_looking_for_match':
+                    break
+            seconds = time.perf_counter() - sent
+            self.recorder.add('ws_looking_for_match', seconds, self.queries.count - query_count)
+        seconds = time.perf_counter() - started
+
+        for socket in sockets:
+            await socket.disconnect()
+
+        await database_sync_to_async(self.end_calls)(clients, partners)
+        matches = len(partners) // 2
+        return {'matches': matches, 'seconds': round(seconds, 4), 'matches_per_second': round(matches / seconds, 1)}
+
+    def write_report(self, results):
+        self.stdout.write(
+            f"users={results['users']} vendor={results['vendor']} "
+            f"backend={results['matchmaking_backend']} order={results['matchmaking_order']}"
+        )
+        self.stdout.write(f"{'step':<22} {'reqs':>6} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}")
+        for step, row in results['steps'].items():
+            self.stdout.write(
+                f"{step:<22} {row['requests']:>6} {row['errors']:>4} {row['p50_ms']:>8.2f} "
+                f"{row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['queries_per_request']:>8.2f}"
+            )
+        for transport, row in results['matching'].items():
+            self.stdout.write(f"{transport}: {row['matches']} matches in {row['seconds']:.3f}s ({row['matches_per_second']}/s)")
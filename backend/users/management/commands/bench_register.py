@@ -0,0 +1,59 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from users.management.commands.bench_matchmaking import API, QueryCounter, Recorder
+from users.management.testdb import throwaway_database
+from users.pool import account_pool
+
+
+class Command(BaseCommand):
+    help = (
+        "Register N anonymous users through the REST endpoint, one after "
+        "another against a throwaway test database, and report signups per "
+        "wall-clock and per CPU second, latency and queries per signup. With "
+        "--pool, the account pool is filled to that size first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500, help='Signups to run')
+        parser.add_argument('--pool', type=int, default=0, help='Account pool size (0 disables the pool)')
+
+    def handle(self, *args, **options):
+        recorder = Recorder()
+        queries = QueryCounter()
+        client = APIClient()
+
+        account_pool.size = options['pool']
+        with throwaway_database():
+            while account_pool.refill():
+                pass
+            queries.start()
+            try:
+                started, cpu_started = time.perf_counter(), time.process_time()
+                for _ in range(options['users']):
+                    query_count = queries.count
+                    sent = time.perf_counter()
+                    response = client.post(f'{API}/register/')
+                    seconds = time.perf_counter() - sent
+                    recorder.add('register', seconds, queries.count - query_count, response.status_code == 201)
+                seconds, cpu_seconds = time.perf_counter() - started, time.process_time() - cpu_started
+            finally:
+                queries.stop()
+                pool = account_pool.metrics()
+        account_pool.size = settings.ACCOUNT_POOL_SIZE
+
+        row = recorder.summary()['register']
+        self.stdout.write(
+            f"{row['requests']} signups, {row['errors']} errors, {row['queries_per_request']:.2f} queries each"
+        )
+        self.stdout.write(
+            f"p50 {row['p50_ms']:.2f} ms, p95 {row['p95_ms']:.2f} ms, p99 {row['p99_ms']:.2f} ms"
+        )
+        self.stdout.write(
+            f"{row['requests'] / seconds:.1f} signups/s, {row['requests'] / cpu_seconds:.1f} per CPU second"
+        )
+        if options['pool']:
+            self.stdout.write(f"pool: {pool['hits']} hits, {pool['misses']} misses, {pool['created_total']} created")
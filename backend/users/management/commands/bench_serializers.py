@@ -0,0 +1,83 @@
+import timeit
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from users.models import ChatMessage, User, VideoCall
+from users.serializers import (
+    ChatMessageSerializer, UserSerializer, VideoCallSerializer,
+    call_data, message_data, messages_data, user_data
+)
+
+
+def sample_objects():
+    """Unsaved instances covering matched, waiting and ended calls,
+    datetimes with and without microseconds, and a page of messages"""
+    now = timezone.now()
+    alice = User(id=1, username='User_ALICE1', is_online=True, last_seen=now, is_looking_for_call=False)
+    bob = User(id=2, username='User_BOB234', is_online=False, last_seen=now.replace(microsecond=0))
+    active = VideoCall(
+        id=uuid.uuid4(), initiator=alice, participant=bob, status='active',
+        created_at=now - timedelta(minutes=1), started_at=now, duration=0
+    )
+    waiting = VideoCall(id=uuid.uuid4(), initiator=bob, status='waiting', created_at=now)
+    ended = VideoCall(
+        id=uuid.uuid4(), initiator=alice, participant=bob, status='ended',
+        created_at=now - timedelta(minutes=5), started_at=now - timedelta(minutes=4),
+        ended_at=now, duration=240
+    )
+    messages = [
+        ChatMessage(id=uuid.uuid4(), call=active, sender=alice if i % 2 else bob, content=f'message {i} ✓', timestamp=now)
+        for i in range(50)
+    ]
+    return [alice, bob], [active, waiting, ended], messages
+
+
+class Command(BaseCommand):
+    help = (
+        "Check that the hand-written payload builders render byte-identical "
+        "JSON to the DRF serializers they replace, and time both."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=2000, help='Iterations per timing')
+
+    def handle(self, *args, **options):
+        users, calls, messages = sample_objects()
+        renderer = JSONRenderer()
+
+        cases = [
+            ('user', lambda: UserSerializer(users[0]).data, lambda: user_data(users[0])),
+            ('call (matched)', lambda: VideoCallSerializer(calls[0]).data, lambda: call_data(calls[0])),
+            ('match payload', lambda: {
+                'call': VideoCallSerializer(calls[0]).data,
+                'matched_user': UserSerializer(users[1]).data,
+            }, lambda: {
+                'call': call_data(calls[0]),
+                'matched_user': user_data(users[1]),
+            }),
+            ('50 messages', lambda: ChatMessageSerializer(messages, many=True).data,
+             lambda: messages_data(messages)),
+        ]
+
+        # Every shape, including waiting and ended calls, must match exactly
+        checks = [(UserSerializer(user).data, user_data(user)) for user in users]
+        checks += [(VideoCallSerializer(call).data, call_data(call)) for call in calls]
+        checks += [(ChatMessageSerializer(message).data, message_data(message)) for message in messages]
+        checks += [(drf(), fast()) for _, drf, fast in cases]
+        for expected, actual in checks:
+            if renderer.render(expected) != renderer.render(actual):
+                raise CommandError(f'Output differs:\n  {renderer.render(expected)}\n  {renderer.render(actual)}')
+        self.stdout.write(self.style.SUCCESS(f'{len(checks)} payloads render byte-identical JSON'))
+
+        number = options['number']
+        self.stdout.write(f"{'shape':<16} {'drf us':>9} {'fast us':>9} {'speedup':>8}")
+        for name, drf, fast in cases:
+            drf_seconds = min(timeit.repeat(drf, number=number, repeat=3)) / number
+            fast_seconds = min(timeit.repeat(fast, number=number, repeat=3)) / number
+            self.stdout.write(
+                f'{name:<16} {drf_seconds * 1e6:>9.1f} {fast_seconds * 1e6:>9.1f} {drf_seconds / fast_seconds:>7.1f}x'
+            )
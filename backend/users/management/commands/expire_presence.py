@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from users.expiry import presence_expiry
+
+
+class Command(BaseCommand):
+    help = "Mark users without a recent heartbeat offline and end their calls."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--timeout', type=int, default=presence_expiry.timeout,
+                            help='Seconds without a heartbeat before a user is expired')
+
+    def handle(self, *args, **options):
+        presence_expiry.timeout = options['timeout']
+        expired = presence_expiry.sweep()
+        metrics = presence_expiry.metrics()
+        self.stdout.write(
+            f"Expired {expired} users in {metrics['last_sweep_seconds']}s "
+            f"(timeout {metrics['timeout']}s)"
+        )
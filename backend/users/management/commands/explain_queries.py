@@ -0,0 +1,81 @@
+import re
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from users.models import ChatMessage, User, VideoCall
+
+
+def hot_queries():
+    """The query shapes on the matching, presence and chat hot paths"""
+    call_id = uuid.uuid4()
+    cutoff = timezone.now() - timedelta(seconds=90)
+    return [
+        ('match: oldest waiting call', VideoCall.objects.filter(
+            status='waiting',
+            participant__isnull=True,
+            initiator__is_online=True
+        ).exclude(initiator_id=0).order_by('created_at')[:1]),
+        ('expiry: stale online users', User.objects.filter(
+            is_online=True,
+            last_seen__lt=cutoff
+        ).values_list('id', flat=True)),
+        ('expiry: live calls of users', VideoCall.objects.filter(
+            Q(initiator_id__in=[0]) | Q(participant_id__in=[0]),
+            status__in=['waiting', 'active']
+        ).values_list('id', flat=True)),
+        ('expiry: partners of calls', User.objects.filter(current_call_id__in=[call_id])),
+        ('chat: page of a call after a cursor', ChatMessage.objects.filter(
+            Q(timestamp__gt=cutoff) | Q(timestamp=cutoff, id__gt=call_id),
+            call_id=call_id
+        ).select_related('sender').order_by('timestamp', 'id')[:101]),
+    ]
+
+
+# Plan lines that read a whole table instead of going through an index
+FULL_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (\w+)\b(?! USING)'),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the EXPLAIN plan of every hot query. With --check, fail if any "
+        "of them reads a table without an index, so regressions show up in CI."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Exit with an error on full table scans')
+
+    def handle(self, *args, **options):
+        pattern = FULL_SCAN_PATTERNS.get(connection.vendor)
+
+        if connection.vendor == 'postgresql':
+            # Empty CI tables make a sequential scan look cheapest; only
+            # fall back to one when no index can answer the query
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+        full_scans = []
+        for name, queryset in hot_queries():
+            plan = queryset.explain()
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(plan)
+            self.stdout.write('')
+            if pattern:
+                full_scans.extend(f'{name}: {table}' for table in pattern.findall(plan))
+
+        if pattern is None:
+            self.stdout.write(f'Full scan check not supported on {connection.vendor}')
+        elif full_scans:
+            message = 'Full table scans in hot queries:\n  ' + '\n  '.join(full_scans)
+            if options['check']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('Every hot query uses an index'))
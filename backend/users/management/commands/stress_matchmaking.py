@@ -0,0 +1,114 @@
+import queue
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils import timezone
+
+from users.management.testdb import throwaway_database
+from users.matchmaking import find_match, match_queue
+from users.models import User, VideoCall
+from users.presence import presence
+
+
+class Command(BaseCommand):
+    help = (
+        "Pair users from many threads at once and check that nobody is "
+        "matched twice. Runs against a throwaway test database and reports "
+        "pairs per second for each worker count."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pairs', type=int, default=200, help='Pairs to form per round')
+        parser.add_argument('--workers', default='1,2,4,8', help='Comma-separated worker counts')
+        parser.add_argument('--backend', choices=['memory', 'database'], default=settings.MATCHMAKING_BACKEND)
+
+    def handle(self, *args, **options):
+        settings.MATCHMAKING_BACKEND = options['backend']
+        worker_counts = [int(count) for count in options['workers'].split(',')]
+
+        with throwaway_database():
+            self.stdout.write(f"backend={options['backend']} vendor={connection.vendor} pairs={options['pairs']}")
+            self.stdout.write(f"{'workers':>8} {'pairs':>6} {'unmatched':>9} {'double':>6} {'seconds':>8} {'pairs/s':>8}")
+            failed = False
+            for round_number, workers in enumerate(worker_counts):
+                result = self.run_round(round_number, workers, options['pairs'])
+                failed = failed or result['double'] > 0
+                self.stdout.write(
+                    f"{workers:>8} {result['pairs']:>6} {result['unmatched']:>9} {result['double']:>6} "
+                    f"{result['seconds']:>8.3f} {result['pairs'] / result['seconds']:>8.1f}"
+                )
+
+        if failed:
+            raise CommandError('Users were matched more than once')
+
+    def create_waiting_users(self, round_number, count):
+        now = timezone.now()
+        users = User.objects.bulk_create([
+            User(username=f'stress_{round_number}_{index}', password='!', is_online=True, last_seen=now)
+            for index in range(count)
+        ])
+        calls = VideoCall.objects.bulk_create([VideoCall(initiator=user) for user in users])
+        for user, call in zip(users, calls):
+            user.current_call = call
+            user.is_looking_for_call = True
+            match_queue.enqueue(user.id, call.id)
+        User.objects.bulk_update(users, ['current_call', 'is_looking_for_call'])
+        return [user.id for user in users]
+
+    def run_round(self, round_number, workers, pairs):
+        user_ids = self.create_waiting_users(round_number, pairs * 2)
+        work = queue.Queue()
+        for user_id in user_ids:
+            work.put(user_id)
+        errors = []
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        user_id = work.get_nowait()
+                    except queue.Empty:
+                        return
+                    user = User.objects.select_related('current_call').get(id=user_id)
+                    if user.current_call.status == 'waiting':
+                        find_match(user)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - started
+
+        if errors:
+            raise CommandError(f'Worker failed: {errors[0]!r}')
+
+        for user_id in user_ids:
+            match_queue.cancel(user_id)
+        presence.flush()
+
+        # Every active call must point at a partner whose own call points
+        # back, and nobody may be the participant of two active calls
+        active = list(VideoCall.objects.filter(
+            initiator_id__in=user_ids, status='active'
+        ).values_list('initiator_id', 'participant_id'))
+        partner_of = dict(active)
+        participant_counts = Counter(participant_id for _, participant_id in active)
+        double = sum(1 for count in participant_counts.values() if count > 1)
+        double += sum(1 for initiator_id, participant_id in active if partner_of.get(participant_id) != initiator_id)
+
+        return {
+            'pairs': len(active) // 2,
+            'unmatched': len(user_ids) - len(active),
+            'double': double,
+            'seconds': seconds,
+        }
@@ -0,0 +1,42 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.db import connection
+
+from users.auth import user_cache
+from users.chat import chat_buffer
+from users.matchmaking import match_queue
+from users.pool import account_pool
+from users.presence import presence
+
+
+@contextmanager
+def throwaway_database():
+    """Point the default connection at a fresh test database for the block.
+
+    SQLite's default in-memory test database can't be shared by several
+    threads writing at once, so a temporary file is used instead. In-process
+    presence and queue state is flushed and cleared before the real database
+    is restored, so nothing leaks into it.
+    """
+    tmp_dir = None
+    if connection.vendor == 'sqlite':
+        tmp_dir = tempfile.mkdtemp()
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmp_dir, 'bench.sqlite3')
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        account_pool.stop()
+        presence.flush()
+        presence.clear()
+        chat_buffer.flush()
+        match_queue.clear()
+        user_cache.clear()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
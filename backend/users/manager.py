@@ -1,5 +1,13 @@
+import base64
+
 from django.contrib.auth.base_user import BaseUserManager
 
+
+def anonymous_username(session_id):
+    """``User_`` and 80 bits of the user's random ``session_id``, base32-encoded"""
+    return 'User_' + base64.b32encode(session_id.bytes[:10]).decode()
+
+
 class UserManager(BaseUserManager):
     use_in_migrations = True
 
@@ -9,6 +17,24 @@ class UserManager(BaseUserManager):
         user.save(using=self._db)
         return user
 
+    def build_anonymous_user(self, **extra_fields):
+        """An unsaved account nobody logs in to with a password.
+
+        The password is unusable, so nothing is hashed, and the username is
+        derived from the random ``session_id``, so it needs no uniqueness
+        check; the unique constraint still backs it.
+        """
+        user = self.model(**extra_fields)
+        user.username = anonymous_username(user.session_id)
+        user.set_unusable_password()
+        return user
+
+    def create_anonymous_user(self, **extra_fields):
+        """Create an anonymous account with one INSERT"""
+        user = self.build_anonymous_user(**extra_fields)
+        user.save(using=self._db, force_insert=True)
+        return user
+
     def create_superuser(self, username, password, **extra_fields):
         extra_fields.setdefault("is_staff", True)
         extra_fields.setdefault("is_superuser", True)
@@ -0,0 +1,248 @@
+import random
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .lifecycle import match_calls
+from .models import User, VideoCall
+from .presence import presence
+from .registry import frame_event, send_to_user
+from .serializers import call_data, user_data
+
+
+class MatchQueue:
+    """In-process queue of users waiting for a random partner.
+
+    Entries are keyed by user id and map to the id of the user's waiting
+    ``VideoCall``, so enqueue, dequeue and cancel are all O(1). The queue
+    lives in the worker process; the database is only used to persist the
+    resulting call pair.
+
+    With ``order='fifo'`` partners are taken in arrival order; with
+    ``order='random'`` they are picked uniformly at random, also in O(1),
+    from a list of the waiting ids kept alongside (removal swaps the last
+    id into the freed slot).
+    """
+
+    def __init__(self, order='fifo'):
+        self.order = order
+        self._waiting = OrderedDict()
+        self._ids = []
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def _add(self, user_id, call_id):
+        if user_id not in self._waiting:
+            self._positions[user_id] = len(self._ids)
+            self._ids.append(user_id)
+        self._waiting[user_id] = call_id
+
+    def _remove(self, user_id):
+        call_id = self._waiting.pop(user_id, None)
+        position = self._positions.pop(user_id, None)
+        if position is not None:
+            last_id = self._ids.pop()
+            if last_id != user_id:
+                self._ids[position] = last_id
+                self._positions[last_id] = position
+        return call_id
+
+    def enqueue(self, user_id, call_id):
+        """Add a user to the back of the queue, or refresh their call id
+        without losing their place if they are already waiting"""
+        with self._lock:
+            self._add(user_id, call_id)
+
+    def cancel(self, user_id):
+        """Remove a user from the queue, returning their call id if queued"""
+        with self._lock:
+            return self._remove(user_id)
+
+    def pop_partner(self, user_id):
+        """Pop a waiting user other than ``user_id``.
+
+        ``user_id`` is removed from the queue as well when a partner is
+        found. Returns ``(partner_id, partner_call_id)`` or ``None``.
+        """
+        with self._lock:
+            candidate_id = self._pick(user_id)
+            if candidate_id is None:
+                return None
+            call_id = self._remove(candidate_id)
+            self._remove(user_id)
+            return candidate_id, call_id
+
+    def _pick(self, user_id):
+        if self.order == 'random':
+            # Sample uniformly from every slot except the caller's own
+            own_position = self._positions.get(user_id)
+            count = len(self._ids) - (own_position is not None)
+            if count == 0:
+                return None
+            index = random.randrange(count)
+            if own_position is not None and index >= own_position:
+                index += 1
+            return self._ids[index]
+
+        for candidate_id in self._waiting:
+            if candidate_id != user_id:
+                return candidate_id
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._waiting.clear()
+            self._ids.clear()
+            self._positions.clear()
+
+    def restore(self, user_id, call_id):
+        """Put a popped user back at the front of the queue"""
+        with self._lock:
+            self._add(user_id, call_id)
+            self._waiting.move_to_end(user_id, last=False)
+
+    def __contains__(self, user_id):
+        return user_id in self._waiting
+
+    def __len__(self):
+        return len(self._waiting)
+
+
+match_queue = MatchQueue(settings.MATCHMAKING_ORDER)
+
+# How often the database backend retries when its own call is locked by
+# another request that may be pairing with it
+MATCH_CLAIM_ATTEMPTS = 3
+
+
+# Serializes pairing on databases without row locks (SQLite), where
+# SELECT ... FOR UPDATE is silently ignored
+_pairing_lock = threading.Lock()
+
+
+def _pairing_guard():
+    if connection.features.has_select_for_update_skip_locked:
+        return nullcontext()
+    return _pairing_lock
+
+
+def _call_is_waiting(call_id):
+    return VideoCall.objects.filter(id=call_id, status='waiting').exists()
+
+
+def _find_match_in_queue(user):
+    call = user.current_call
+
+    while True:
+        partner = match_queue.pop_partner(user.id)
+        if partner is None:
+            break
+
+        partner_id, partner_call_id = partner
+        if presence.is_online(partner_id) is False:
+            continue
+
+        with _pairing_guard(), transaction.atomic():
+            paired = match_calls(user, partner_id, partner_call_id, timezone.now())
+        if paired:
+            return User.objects.select_related('current_call').get(id=partner_id)
+
+        # Someone else claimed our own call in the meantime; they notify
+        # both users, so hand the partner back and stop here
+        if not _call_is_waiting(call.id):
+            if _call_is_waiting(partner_call_id):
+                match_queue.restore(partner_id, partner_call_id)
+            return None
+
+    match_queue.enqueue(user.id, call.id)
+    return None
+
+
+def _find_match_in_database(user):
+    call = user.current_call
+
+    for attempt in range(MATCH_CLAIM_ATTEMPTS):
+        with _pairing_guard(), transaction.atomic():
+            # Oldest waiting call nobody else is claiming right now
+            partner_call = VideoCall.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+                status='waiting',
+                participant__isnull=True,
+                initiator__is_online=True
+            ).exclude(initiator_id=user.id).order_by('created_at').first()
+            if partner_call is None:
+                return None
+
+            # Our own row is locked when another request is claiming us
+            own_call = VideoCall.objects.select_for_update(skip_locked=True).filter(
+                id=call.id,
+                status='waiting'
+            ).first()
+            if own_call is not None:
+                partner_id = partner_call.initiator_id
+                if match_calls(user, partner_id, partner_call.id, timezone.now()):
+                    return User.objects.select_related('current_call').get(id=partner_id)
+
+        if not _call_is_waiting(call.id):
+            return None
+
+    return None
+
+
+def find_match(user):
+    """Pair ``user`` with a waiting user.
+
+    With the ``memory`` backend partners come from the in-process queue
+    (picked at random or in arrival order, see ``MATCHMAKING_ORDER``);
+    with ``database`` the oldest waiting call is claimed with
+    ``SELECT ... FOR UPDATE SKIP LOCKED``, so several workers can share
+    one waiting pool. Either way both calls are claimed with conditional
+    UPDATEs in one transaction, so nobody is ever paired twice.
+
+    Returns the matched ``User`` with their updated ``current_call`` loaded,
+    or ``None`` if nobody is waiting (the user is left waiting) or another
+    request paired the user in the meantime (that request sends the
+    notifications).
+    """
+    if settings.MATCHMAKING_BACKEND == 'database':
+        return _find_match_in_database(user)
+    return _find_match_in_queue(user)
+
+
+def match_payload(user, matched_user):
+    """Match response as seen by ``user``"""
+    return {
+        'matched': True,
+        'call': call_data(user.current_call),
+        'matched_user': user_data(matched_user),
+        'match_type': 'current_user'
+    }
+
+
+def match_event(user, matched_user):
+    """Channel layer event with the ``match_found`` frame for ``user``'s sockets"""
+    payload = match_payload(user, matched_user)
+    return frame_event({
+        'type': 'match_found',
+        'call_id': str(user.current_call_id),
+        'matched_users': [],
+        'call': payload['call'],
+        'matched_user': payload['matched_user'],
+        'match_type': payload['match_type']
+    })
+
+
+def notify_match(user, matched_user):
+    """Push a ``match_found`` event to both users' matching sockets"""
+    channel_layer = get_channel_layer()
+    for recipient, other in ((user, matched_user), (matched_user, user)):
+        async_to_sync(send_to_user)(
+            channel_layer,
+            recipient.id,
+            match_event(recipient, other)
+        )
@@ -1,47 +1,53 @@
+import logging
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
-from channels.auth import AuthMiddlewareStack
 from django.contrib.auth.models import AnonymousUser
-from django.contrib.auth import get_user_model
-import json
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .auth import user_cache
+from .models import User
+
+logger = logging.getLogger(__name__)
 
-User = get_user_model()
 
 class WebSocketAuthMiddleware(BaseMiddleware):
+    """Authenticates WebSocket connections with a SimpleJWT access token.
+
+    Browsers can't set headers on a WebSocket, so the token comes in the
+    ``token`` query parameter. Its signature and expiry are checked locally
+    and the user is looked up through ``user_cache``, so a wave of
+    reconnects (e.g. after a deploy) costs no queries for users seen in the
+    last ``USER_CACHE_TTL`` seconds. Without a valid token the connection
+    gets ``AnonymousUser``.
+    """
+
     async def __call__(self, scope, receive, send):
-        print(f"WebSocket middleware processing: {scope}")
-        
-        # Extract username from query parameters
-        query_string = scope.get('query_string', b'').decode()
-        username = None
-        if query_string:
-            params = dict(param.split('=') for param in query_string.split('&') if '=' in param)
-            username = params.get('username')
-        
-        print(f"Extracted username: {username}")
-        
-        # Try to get user by username, but don't fail if not found
-        if username:
-            try:
-                user = await self.get_user_by_username(username)
-                scope['user'] = user
-                print(f"User found: {user.username if user else 'None'}")
-            except Exception as e:
-                print(f"Error getting user: {e}")
-                scope['user'] = AnonymousUser()
-        else:
-            scope['user'] = AnonymousUser()
-            print("No username provided, using AnonymousUser")
-        
+        scope['user'] = await self.authenticate(scope)
         return await super().__call__(scope, receive, send)
-    
-    async def get_user_by_username(self, username):
-        """Get user by username asynchronously"""
+
+    async def authenticate(self, scope):
+        params = parse_qs(scope.get('query_string', b'').decode())
+        token = params.get('token', [None])[0]
+        if not token:
+            return AnonymousUser()
+
+        try:
+            token = AccessToken(token)
+            user_id = token[api_settings.USER_ID_CLAIM]
+        except (TokenError, KeyError):
+            logger.info("Rejected WebSocket token", extra={'path': scope.get('path')})
+            return AnonymousUser()
+
+        return await self.get_user(user_id, token.get(api_settings.JTI_CLAIM))
+
+    @database_sync_to_async
+    def get_user(self, user_id, token_id):
         try:
-            return await self.database_sync_to_async(User.objects.get)(username=username)
+            user = user_cache.get_user(user_id, token_id)
         except User.DoesNotExist:
             return AnonymousUser()
-    
-    def database_sync_to_async(self, func):
-        """Simple database sync to async wrapper"""
-        from channels.db import database_sync_to_async
-        return database_sync_to_async(func) 
\ No newline at end of file
+        return user if user.is_active else AnonymousUser()
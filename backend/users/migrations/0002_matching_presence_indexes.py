@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-17 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='user',
+            options={'verbose_name': 'user', 'verbose_name_plural': 'users'},
+        ),
+        migrations.AlterModelOptions(
+            name='videocall',
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['call', 'timestamp'], name='message_call_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('is_online', True)), fields=['last_seen'], name='user_online_last_seen_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videocall',
+            index=models.Index(fields=['status', 'created_at'], name='call_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videocall',
+            index=models.Index(condition=models.Q(('participant__isnull', True), ('status', 'waiting')), fields=['created_at'], name='call_waiting_created_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-17 14:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_chat_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='chatmessage',
+            name='message_call_timestamp_idx',
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['call', 'timestamp', 'id'], name='message_call_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-17 14:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_chat_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='pooled',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('pooled', True)), fields=['id'], name='user_pooled_idx'),
+        ),
+    ]
@@ -15,6 +15,8 @@ class User(AbstractUser):
     # Video call preferences
     is_looking_for_call = models.BooleanField(default=False)
     current_call = models.ForeignKey('VideoCall', on_delete=models.SET_NULL, null=True, blank=True, related_name='participants')
+    # Created ahead of time by the account pool and not handed out yet
+    pooled = models.BooleanField(default=False)
 
     USERNAME_FIELD = 'username'
     REQUIRED_FIELDS = []
@@ -25,7 +27,12 @@ class User(AbstractUser):
         db_table = 'user_user'
         verbose_name = 'user'
         verbose_name_plural = 'users'
-        ordering = ["-id"]
+        indexes = [
+            # Presence expiry sweep: online users whose heartbeat is stale
+            models.Index(fields=['last_seen'], condition=models.Q(is_online=True), name='user_online_last_seen_idx'),
+            # Account pool: rows left over from a previous run
+            models.Index(fields=['id'], condition=models.Q(pooled=True), name='user_pooled_idx'),
+        ]
 
     def __str__(self):
         return self.username
@@ -50,7 +57,15 @@ class VideoCall(models.Model):
     
     class Meta:
         db_table = 'video_calls'
-        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='call_status_created_idx'),
+            # Database matchmaking: oldest call still waiting for a partner
+            models.Index(
+                fields=['created_at'],
+                condition=models.Q(status='waiting', participant__isnull=True),
+                name='call_waiting_created_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"Call {self.id} - {self.status}"
@@ -61,11 +76,15 @@ class ChatMessage(models.Model):
     call = models.ForeignKey(VideoCall, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the message is sent, not when the batch it's in is written
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
         db_table = 'chat_messages'
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['call', 'timestamp', 'id'], name='message_call_keyset_idx'),
+        ]
     
     def __str__(self):
         return f"Message from {self.sender.username} in {self.call.id}"
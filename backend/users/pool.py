@@ -0,0 +1,160 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import connection, connections
+from django.utils import timezone
+
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+
+class AccountPool:
+    """Anonymous accounts created ahead of time, for bursts of signups.
+
+    A background thread keeps up to ``size`` unclaimed (``pooled``) users
+    ready, adding at most ``batch_size`` rows with one ``bulk_create``
+    every ``refill_interval`` seconds, which caps the write rate the pool
+    adds during a burst. Registration claims a user with a conditional
+    UPDATE, so a row can only ever be handed out once, and creates the
+    user itself when the pool is empty (a miss).
+
+    Each worker keeps its own pool. The server entry points call
+    ``start()``, which fills it batch after batch without waiting, so it is
+    full before the first burst; the rate cap only applies to refills after
+    that. On its first refill it also adopts pooled rows left by earlier
+    runs; if two workers adopt the same row, the UPDATE lets only one of
+    them claim it. A ``size`` of 0 disables the pool.
+    """
+
+    def __init__(self, size, batch_size=100, refill_interval=1):
+        self.size = size
+        self.batch_size = batch_size
+        self.refill_interval = refill_interval
+        self._users = deque()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refiller = None
+        self._adopted = False
+        self.hits = 0
+        self.misses = 0
+        self.created_total = 0
+        self.adopted_total = 0
+        self.last_refill_at = None
+
+    def claim(self):
+        """A pooled user, now signed up and online, or ``None`` on a miss"""
+        if not self.size:
+            return None
+        self.start()
+
+        while True:
+            with self._lock:
+                if not self._users:
+                    self.misses += 1
+                    return None
+                user = self._users.popleft()
+
+            now = timezone.now()
+            claimed = User.objects.filter(id=user.id, pooled=True).update(
+                pooled=False, is_online=True, last_seen=now, date_joined=now
+            )
+            if claimed:
+                user.pooled = False
+                user.is_online = True
+                user.last_seen = user.date_joined = now
+                with self._lock:
+                    self.hits += 1
+                return user
+            # Claimed by another worker that adopted the same row
+
+    def refill(self):
+        """Add at most one batch of users, returning how many were added"""
+        with self._lock:
+            missing = min(self.size - len(self._users), self.batch_size)
+        if missing <= 0:
+            return 0
+
+        users = []
+        if not self._adopted:
+            users = list(User.objects.filter(pooled=True).order_by('id')[:missing])
+            self._adopted = True
+            self.adopted_total += len(users)
+
+        if len(users) < missing:
+            created = User.objects.bulk_create([
+                User.objects.build_anonymous_user(pooled=True)
+                for _ in range(missing - len(users))
+            ])
+            if not connection.features.can_return_rows_from_bulk_insert:
+                created = list(User.objects.filter(username__in=[user.username for user in created]))
+            self.created_total += len(created)
+            users += created
+
+        with self._lock:
+            self._users.extend(users)
+        self.last_refill_at = timezone.now()
+        return len(users)
+
+    def metrics(self):
+        with self._lock:
+            available = len(self._users)
+        lookups = self.hits + self.misses
+        return {
+            'size': self.size,
+            'available': available,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'created_total': self.created_total,
+            'adopted_total': self.adopted_total,
+            'last_refill_at': self.last_refill_at,
+        }
+
+    def start(self):
+        """Start filling the pool in the background, unless it is disabled"""
+        if self.size and self._refiller is None:
+            self._start_refiller()
+
+    def stop(self):
+        """Stop the refiller and forget the pooled users held in memory"""
+        self._stop.set()
+        if self._refiller is not None:
+            self._refiller.join()
+        with self._lock:
+            self._users.clear()
+            self._refiller = None
+            self._adopted = False
+        self._stop.clear()
+
+    def _start_refiller(self):
+        with self._lock:
+            if self._refiller is not None:
+                return
+            self._refiller = threading.Thread(target=self._run_refiller, name='account-pool', daemon=True)
+        self._refiller.start()
+
+    def _run_refiller(self):
+        try:
+            while not self._stop.is_set() and self.refill():
+                pass
+        except Exception:
+            logger.exception("Error filling the account pool")
+        finally:
+            connections.close_all()
+
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.refill()
+            except Exception:
+                logger.exception("Error refilling the account pool")
+            finally:
+                connections.close_all()
+            self._stop.wait(max(0, self.refill_interval - (time.monotonic() - started)))
+
+
+account_pool = AccountPool(settings.ACCOUNT_POOL_SIZE, settings.ACCOUNT_POOL_BATCH_SIZE, settings.ACCOUNT_POOL_REFILL_INTERVAL)
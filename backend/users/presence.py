@@ -0,0 +1,125 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .auth import user_cache
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceStore:
+    """Live ``is_online``/``last_seen`` values, written to the DB in batches.
+
+    Heartbeats only update this in-process map; a background thread
+    flushes the users that changed with one ``bulk_update`` every
+    ``flush_interval`` seconds. An interval of 0 writes through on every
+    change, which is handy when debugging.
+
+    Users this process hasn't seen fall back to the values on the row.
+    Flushed users are invalidated in ``user_cache``, so cached copies pick
+    up the new values within one flush interval.
+    """
+
+    def __init__(self, flush_interval, batch_size=500):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._entries = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def touch(self, user_id, when=None):
+        """Record activity from a user, marking them online"""
+        self._set(user_id, True, when or timezone.now())
+
+    def mark_offline(self, user_id, when=None):
+        self._set(user_id, False, when or timezone.now())
+
+    def _set(self, user_id, is_online, last_seen):
+        with self._lock:
+            self._entries[user_id] = (is_online, last_seen)
+            self._dirty.add(user_id)
+        if not self.flush_interval:
+            self.flush()
+        elif self._flusher is None:
+            self._start_flusher()
+
+    def discard(self, user_ids):
+        """Forget live values, e.g. for users that were expired"""
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+                self._dirty.discard(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty.clear()
+
+    def get(self, user):
+        """``(is_online, last_seen)`` for a user, preferring live values"""
+        entry = self._entries.get(user.id)
+        if entry is None:
+            return user.is_online, user.last_seen
+        return entry
+
+    def is_online(self, user_id):
+        """Live online state, or ``None`` if this process hasn't seen the user"""
+        entry = self._entries.get(user_id)
+        return entry[0] if entry else None
+
+    def last_seen(self, user_id):
+        """Live last activity, or ``None`` if this process hasn't seen the user"""
+        entry = self._entries.get(user_id)
+        return entry[1] if entry else None
+
+    def flush(self):
+        """Write every changed user to the DB in one batched UPDATE"""
+        with self._lock:
+            if not self._dirty:
+                return 0
+            users = [
+                User(id=user_id, is_online=self._entries[user_id][0], last_seen=self._entries[user_id][1])
+                for user_id in self._dirty
+            ]
+            flushed, self._dirty = self._dirty, set()
+        try:
+            User.objects.bulk_update(users, ['is_online', 'last_seen'], batch_size=self.batch_size)
+        except Exception:
+            with self._lock:
+                self._dirty |= flushed
+            raise
+        user_cache.invalidate(flushed)
+
+        # Offline users are now on the row; only keep live entries in memory
+        with self._lock:
+            for user_id in flushed - self._dirty:
+                if not self._entries[user_id][0]:
+                    del self._entries[user_id]
+        return len(users)
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._run_flusher, name='presence-flusher', daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def _run_flusher(self):
+        stop = threading.Event()
+        while not stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Error flushing presence")
+            finally:
+                connections.close_all()
+
+
+presence = PresenceStore(settings.PRESENCE_FLUSH_INTERVAL)
@@ -0,0 +1,70 @@
+"""
+Binary MessagePack framing for the WebSocket consumers.
+
+Clients that offer the ``SUBPROTOCOL`` WebSocket subprotocol get binary
+MessagePack frames instead of JSON text; everyone else keeps JSON. A frame
+of one of the ``FRAMES`` types is packed as an array of its type code
+followed by its fields in a fixed order, so neither the type name nor the
+keys go over the wire. Frames of other types, or with extra keys, are
+packed as maps. Nested values (SDP, candidates, call data) stay maps.
+
+Needs the ``msgpack`` package; without it ``AVAILABLE`` is false, the
+subprotocol is never accepted and every client gets JSON.
+"""
+
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+AVAILABLE = msgpack is not None
+
+SUBPROTOCOL = 'msgpack.v1'
+
+# Type codes and field order. Codes are part of the protocol: never reuse
+# or renumber them, only add new ones.
+FRAMES = (
+    (1, 'webrtc_signal', ('message', 'username')),
+    (2, 'webrtc_signals', ('messages', 'username')),
+    (3, 'chat_message', ('message', 'username')),
+    (4, 'connection_established', ('message', 'call_id', 'username')),
+    (5, 'error', ('message',)),
+    (6, 'echo', ('message',)),
+    (7, 'user_join', ('username',)),
+    (8, 'user_leave', ('username',)),
+    (9, 'looking_for_match', ('call_id',)),
+    (10, 'user_looking_for_match', ('username', 'call_id')),
+    (11, 'match_found', ('call_id', 'matched_users', 'call', 'matched_user', 'match_type')),
+)
+
+_BY_TYPE = {name: (code, fields, {'type', *fields}) for code, name, fields in FRAMES}
+_BY_CODE = {code: (name, fields) for code, name, fields in FRAMES}
+
+# UUIDs, datetimes and lazy strings become strings, as in JSON frames
+_encoder = JSONEncoder()
+
+
+def pack(frame):
+    """Encode a frame dict as MessagePack bytes"""
+    entry = _BY_TYPE.get(frame.get('type'))
+    if entry is not None and frame.keys() <= entry[2]:
+        code, fields, _ = entry
+        frame = [code, *(frame.get(key) for key in fields)]
+    return msgpack.packb(frame, default=_encoder.default)
+
+
+def unpack(data):
+    """Decode a frame packed by ``pack``; raises ``ValueError`` if invalid.
+
+    Clients may leave out trailing fields of an array frame.
+    """
+    content = msgpack.unpackb(data)
+    if isinstance(content, dict):
+        return content
+    if isinstance(content, list) and content and content[0] in _BY_CODE:
+        name, fields = _BY_CODE[content[0]]
+        if len(content) - 1 <= len(fields):
+            return {'type': name, **dict(zip(fields, content[1:]))}
+    raise ValueError('Not a frame')
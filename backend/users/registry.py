@@ -0,0 +1,99 @@
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+from project import codec
+
+from . import protocol
+
+
+class ChannelRegistry:
+    """Maps user ids to the channel names of their open sockets.
+
+    Consumers register on connect and unregister on disconnect, so events
+    for a user can be sent straight to their channels instead of being
+    broadcast to a shared group. A user can have several sockets open
+    (e.g. more than one tab), so each id maps to a set of channel names.
+
+    The mapping lives in the worker process, so it is only used with the
+    in-memory channel layer, where channels can't leave the process anyway.
+    """
+
+    def __init__(self):
+        self._channels = defaultdict(set)
+        self._lock = threading.Lock()
+
+    async def register(self, channel_layer, user_id, channel_name):
+        with self._lock:
+            self._channels[user_id].add(channel_name)
+
+    async def unregister(self, channel_layer, user_id, channel_name):
+        with self._lock:
+            channels = self._channels.get(user_id)
+            if channels is None:
+                return
+            channels.discard(channel_name)
+            if not channels:
+                del self._channels[user_id]
+
+    async def send(self, channel_layer, user_id, event):
+        with self._lock:
+            channel_names = list(self._channels.get(user_id, ()))
+        for channel_name in channel_names:
+            await channel_layer.send(channel_name, event)
+
+
+class GroupChannelRegistry:
+    """Keeps each user's channels in a one-user group on the channel layer.
+
+    With a cross-process layer (Redis) the membership is shared by every
+    worker, so a match formed in one process reaches sockets held by
+    another, and the layer shards the groups across its hosts.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def group_name(self, user_id):
+        return f'{self.prefix}_{user_id}'
+
+    async def register(self, channel_layer, user_id, channel_name):
+        await channel_layer.group_add(self.group_name(user_id), channel_name)
+
+    async def unregister(self, channel_layer, user_id, channel_name):
+        await channel_layer.group_discard(self.group_name(user_id), channel_name)
+
+    async def send(self, channel_layer, user_id, event):
+        await channel_layer.group_send(self.group_name(user_id), event)
+
+
+def _create_registry(prefix):
+    if settings.CHANNEL_LAYERS['default']['BACKEND'] == 'channels.layers.InMemoryChannelLayer':
+        return ChannelRegistry()
+    return GroupChannelRegistry(prefix)
+
+
+matching_registry = _create_registry('matching_user')
+
+
+async def send_to_user(channel_layer, user_id, event):
+    """Deliver a channel layer event to every matching socket of a user"""
+    await matching_registry.send(channel_layer, user_id, event)
+
+
+def frame_event(frame, text=True, binary=False):
+    """Channel layer event carrying ``frame`` already encoded.
+
+    ``text`` adds the JSON text and ``binary`` the MessagePack bytes;
+    consumers send the one their client uses as is and convert from the
+    other only when it is missing (``CodecConsumer.forward_frame``). So a
+    frame delivered to many sockets is encoded once, by the sender, in
+    just the formats its receivers are known to use.
+    """
+    event = {'type': 'forward.frame'}
+    if binary and protocol.AVAILABLE:
+        event['bytes'] = protocol.pack(frame)
+    if text or 'bytes' not in event:
+        event['text'] = codec.dumps_text(frame)
+    return event
@@ -1,3 +1,691 @@
-from django.test import TestCase
+import asyncio
+import threading
+import time
+from datetime import timedelta
+from unittest import skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from channels_redis.core import RedisChannelLayer
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from project import codec
+from users import protocol
+from users.auth import user_cache
+from users.chat import ChatBuffer, chat_buffer, encode_cursor
+from users.expiry import PresenceExpiry
+from users.lifecycle import IllegalTransition, create_call, finish_call, match_calls, transition
+from users.matchmaking import MatchQueue
+from users.middleware import WebSocketAuthMiddleware
+from users.models import ChatMessage, User, VideoCall
+from users.pool import AccountPool
+from users.presence import PresenceStore, presence
+from users.registry import GroupChannelRegistry, frame_event
+from users.routing import websocket_urlpatterns
+from users.serializers import (
+    ChatMessageSerializer, UserSerializer, VideoCallSerializer, call_data, message_data, messages_data, user_data
+)
+from users.versions import call_versions
+
+try:
+    from fakeredis import TcpFakeServer
+except ImportError:
+    TcpFakeServer = None
+
+
+def anonymous_user():
+    return User.objects.create_anonymous_user(is_online=True, last_seen=timezone.now())
+
+
+class ChatSocketTests(TransactionTestCase):
+    def setUp(self):
+        self.a, self.b = anonymous_user(), anonymous_user()
+        self.call = VideoCall.objects.create(initiator=self.a, participant=self.b, status='active')
+        self.addCleanup(setattr, chat_buffer, 'flush_interval', chat_buffer.flush_interval)
+
+    async def send_chat(self, user, content):
+        app = WebSocketAuthMiddleware(URLRouter(websocket_urlpatterns))
+        communicator = WebsocketCommunicator(
+            app, f'/ws/video_call/{self.call.id}/?username={user.username}&token={AccessToken.for_user(user)}'
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()
+        await communicator.send_json_to({'type': 'chat_message', 'message': {'content': content}})
+        relayed = await communicator.receive_json_from()
+        await communicator.disconnect()
+        return relayed
+
+    def test_message_is_written_at_once_without_flush_interval(self):
+        chat_buffer.flush_interval = 0
+
+        relayed = async_to_sync(self.send_chat)(self.a, 'hello')
+
+        self.assertEqual(relayed['message'], {'content': 'hello'})
+        self.assertEqual(list(ChatMessage.objects.values_list('content', flat=True)), ['hello'])
+
+    def test_membership_is_looked_up_on_first_message_only(self):
+        chat_buffer.flush_interval = 0
+
+        async def chat():
+            app = WebSocketAuthMiddleware(URLRouter(websocket_urlpatterns))
+            communicator = WebsocketCommunicator(
+                app, f'/ws/video_call/{self.call.id}/?token={AccessToken.for_user(self.a)}'
+            )
+            await communicator.connect()
+            await communicator.receive_json_from()
+            connect_queries = len(queries)
+            for content in ['one', 'two']:
+                await communicator.send_json_to({'type': 'chat_message', 'message': {'content': content}})
+                await communicator.receive_json_from()
+            await communicator.disconnect()
+            return connect_queries
+
+        with CaptureQueriesContext(connection) as queries:
+            connect_queries = async_to_sync(chat)()
+
+        calls = [index for index, query in enumerate(queries) if VideoCall._meta.db_table in query['sql']]
+        # Checked on the first message, not on connect, and only once
+        self.assertEqual(len(calls), 1)
+        self.assertGreaterEqual(calls[0], connect_queries)
+        self.assertEqual(list(ChatMessage.objects.values_list('content', flat=True)), ['one', 'two'])
+
+
+class WebSocketAuthTests(TransactionTestCase):
+    def setUp(self):
+        self.user = anonymous_user()
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+
+    def authenticate(self, query_string):
+        return async_to_sync(WebSocketAuthMiddleware(None).authenticate)({'query_string': query_string.encode()})
+
+    def test_missing_malformed_or_expired_token_is_anonymous(self):
+        expired = AccessToken.for_user(self.user)
+        expired.set_exp(lifetime=-timedelta(seconds=1))
+
+        for query_string in ['', 'username=someone', 'token=', 'token=not-a-jwt', f'token={expired}']:
+            with self.subTest(query_string=query_string):
+                self.assertFalse(self.authenticate(query_string).is_authenticated)
+
+    def test_valid_token_is_served_from_cache_on_reconnect(self):
+        query_string = f'token={AccessToken.for_user(self.user)}'
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate(query_string).id, self.user.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate(query_string).id, self.user.id)
+
+    def test_authenticated_socket_cannot_choose_its_username(self):
+        async def connect(query_string):
+            app = WebSocketAuthMiddleware(URLRouter(websocket_urlpatterns))
+            communicator = WebsocketCommunicator(app, f'/ws/matching/?{query_string}')
+            await communicator.connect()
+            established = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return established['username']
+
+        token = AccessToken.for_user(self.user)
+        self.assertEqual(async_to_sync(connect)(f'username=someone_else&token={token}'), self.user.username)
+        self.assertEqual(async_to_sync(connect)('username=guest'), 'guest')
+
+
+class RegistrationTests(TestCase):
+    def test_registration_is_one_insert_of_a_passwordless_user(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().post('/api/v1/register/')
+
+        self.assertEqual(response.status_code, 201)
+        inserts = [query['sql'] for query in queries if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 1)
+        self.assertIn(User._meta.db_table, inserts[0])
+
+        user = User.objects.get(id=response.json()['user']['id'])
+        self.assertFalse(user.has_usable_password())
+        self.assertRegex(user.username, r'^User_[A-Z2-7]{16}$')
+        self.assertEqual(response.json()['user']['username'], user.username)
+
+
+class ChatHistoryTests(TestCase):
+    def setUp(self):
+        self.a, self.b = anonymous_user(), anonymous_user()
+        self.call = VideoCall.objects.create(initiator=self.a, participant=self.b, status='active')
+        self.client = APIClient()
+        self.client.force_authenticate(self.a)
+        self.url = f'/api/v1/call/{self.call.id}/messages/'
+        # Write this worker's messages as they are sent, not from a thread
+        self.addCleanup(setattr, chat_buffer, 'flush_interval', chat_buffer.flush_interval)
+        chat_buffer.flush_interval = 0
+
+    def poll(self, cursor=None):
+        response = self.client.get(self.url, {'cursor': cursor} if cursor else {})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_cursor_does_not_pass_message_queued_by_another_worker(self):
+        other_worker = ChatBuffer(flush_interval=0)
+        other_worker.add(self.call.id, self.b.id, 'from B')
+        self.client.post(f'{self.url}send/', {'content': 'from A'}, format='json')
+
+        page = self.poll()
+        self.assertEqual([message['content'] for message in page['results']], ['from A'])
+
+        other_worker.flush()
+        page = self.poll(page['next_cursor'])
+        self.assertIn('from B', [message['content'] for message in page['results']])
+        self.assertEqual([message['content'] for message in self.poll()['results']], ['from B', 'from A'])
+
+    def test_cursor_moves_past_settled_messages(self):
+        message = ChatMessage.objects.create(
+            call=self.call, sender=self.b, content='old', timestamp=timezone.now() - timedelta(minutes=1)
+        )
+
+        page = self.poll()
+        self.assertEqual(page['next_cursor'], encode_cursor(message))
+        self.assertEqual(self.poll(page['next_cursor'])['results'], [])
+
+    def test_page_with_unsettled_messages_is_not_revalidated(self):
+        for number in range(3):
+            self.client.post(f'{self.url}send/', {'content': f'm{number}'}, format='json')
+
+        response = self.client.get(self.url, {'limit': 2})
+        self.assertEqual(response.json()['has_more'], False)
+        self.assertNotIn('ETag', response)
+
+        # Once the lag is over the same poll moves on, and can then be cached
+        with override_settings(CHAT_CURSOR_LAG=0):
+            response = self.client.get(self.url, {'limit': 2})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['has_more'], True)
+            response = self.client.get(self.url, {'limit': 2}, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+
+class PresenceExpiryTests(TransactionTestCase):
+    def test_sweeps_run_with_write_through_presence(self):
+        self.addCleanup(setattr, presence, 'flush_interval', presence.flush_interval)
+        presence.flush_interval = 0
+        user = User.objects.create_anonymous_user(is_online=True, last_seen=timezone.now() - timedelta(minutes=5))
+        expiry = PresenceExpiry(timeout=60, interval=0.05)
+        expiry.start()
+        self.addCleanup(expiry.stop)
+
+        deadline = time.monotonic() + 5
+        while expiry.sweeps == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        self.assertGreater(expiry.sweeps, 0)
+        user.refresh_from_db()
+        self.assertFalse(user.is_online)
+
+
+class ExpireUsersTests(TestCase):
+    def setUp(self):
+        # Live heartbeats left by other tests would keep these users online
+        presence.clear()
+        self.now = timezone.now()
+        self.cutoff = self.now - timedelta(seconds=60)
+        self.a = User.objects.create_anonymous_user(is_online=True, last_seen=self.now - timedelta(minutes=5))
+        self.b = anonymous_user()
+        self.calls = [
+            VideoCall.objects.create(initiator=self.a, participant=self.b, status='active', started_at=self.now),
+            VideoCall.objects.create(initiator=self.b, participant=self.a, status='active', started_at=self.now),
+        ]
+        User.objects.filter(id=self.a.id).update(current_call=self.calls[0])
+        User.objects.filter(id=self.b.id).update(current_call=self.calls[1])
+        self.expiry = PresenceExpiry(timeout=60, interval=0)
+
+    def test_stale_user_is_expired_with_their_calls(self):
+        self.assertEqual(self.expiry._expire([self.a.id], self.cutoff, self.now), 1)
+
+        self.assertEqual({call.status for call in VideoCall.objects.all()}, {'ended'})
+        self.assertFalse(User.objects.get(id=self.a.id).is_online)
+        self.assertIsNone(User.objects.get(id=self.b.id).current_call_id)
+
+    def test_heartbeat_flushed_during_sweep_keeps_call(self):
+        # Another worker writes a heartbeat after the stale ids were read
+        User.objects.filter(id=self.a.id).update(last_seen=self.now)
+
+        self.assertEqual(self.expiry._expire([self.a.id], self.cutoff, self.now), 0)
+
+        self.assertEqual({call.status for call in VideoCall.objects.all()}, {'active'})
+        self.assertEqual(User.objects.get(id=self.b.id).current_call_id, self.calls[1].id)
+
+
+class FrameEncodingTests(SimpleTestCase):
+    def test_events_carry_only_text_by_default(self):
+        self.assertEqual(set(frame_event({'type': 'echo', 'message': 'hi'})), {'type', 'text'})
+
+    @skipUnless(protocol.AVAILABLE, 'needs msgpack')
+    async def test_signals_between_text_and_binary_clients(self):
+        app = WebSocketAuthMiddleware(URLRouter(websocket_urlpatterns))
+        text = WebsocketCommunicator(app, '/ws/video_call/mixed/?username=text')
+        binary = WebsocketCommunicator(
+            app, '/ws/video_call/mixed/?username=binary', subprotocols=[protocol.SUBPROTOCOL]
+        )
+        for communicator in (text, binary):
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.receive_from()
+
+        offer = {'type': 'offer', 'sdp': 'v=0'}
+        await binary.send_to(bytes_data=protocol.pack({'type': 'webrtc_signal', 'message': offer}))
+        received = codec.loads(await text.receive_from())
+        self.assertEqual(received, {'type': 'webrtc_signal', 'message': offer, 'username': 'binary'})
+
+        await text.send_json_to({'type': 'webrtc_signal', 'message': offer})
+        received = protocol.unpack(await binary.receive_from())
+        self.assertEqual(received, {'type': 'webrtc_signal', 'message': offer, 'username': 'text'})
+
+        await text.disconnect()
+        await binary.disconnect()
+
+
+class SignalRelayTests(SimpleTestCase):
+    async def join(self, call_id, *usernames):
+        app = WebSocketAuthMiddleware(URLRouter(websocket_urlpatterns))
+        communicators = []
+        for username in usernames:
+            communicator = WebsocketCommunicator(app, f'/ws/video_call/{call_id}/?username={username}')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.receive_json_from()
+            communicators.append(communicator)
+        return communicators
+
+    def candidate(self, n):
+        return {'type': 'ice-candidate', 'candidate': f'candidate:{n}'}
+
+    async def test_signal_is_not_sent_back_to_sender(self):
+        a, b = await self.join('no-echo', 'a', 'b')
+        offer = {'type': 'offer', 'sdp': 'v=0'}
+
+        await a.send_json_to({'type': 'webrtc_signal', 'message': offer})
+
+        self.assertEqual(await b.receive_json_from(), {'type': 'webrtc_signal', 'message': offer, 'username': 'a'})
+        self.assertTrue(await a.receive_nothing())
+        await a.disconnect()
+        await b.disconnect()
+
+    @override_settings(ICE_BATCH_WINDOW=0.05)
+    async def test_candidates_in_window_arrive_as_one_frame(self):
+        a, b = await self.join('batch', 'a', 'b')
+
+        for n in range(3):
+            await a.send_json_to({'type': 'webrtc_signal', 'message': self.candidate(n)})
+
+        self.assertEqual(await b.receive_json_from(), {
+            'type': 'webrtc_signals',
+            'messages': [self.candidate(n) for n in range(3)],
+            'username': 'a'
+        })
+        self.assertTrue(await b.receive_nothing())
+        await a.disconnect()
+        await b.disconnect()
+
+    @override_settings(ICE_BATCH_WINDOW=60)
+    async def test_queued_candidates_go_before_next_signal(self):
+        a, b = await self.join('order', 'a', 'b')
+        answer = {'type': 'answer', 'sdp': 'v=0'}
+
+        for n in range(2):
+            await a.send_json_to({'type': 'webrtc_signal', 'message': self.candidate(n)})
+        await a.send_json_to({'type': 'webrtc_signal', 'message': answer})
+
+        self.assertEqual((await b.receive_json_from())['messages'], [self.candidate(0), self.candidate(1)])
+        self.assertEqual((await b.receive_json_from())['message'], answer)
+        await a.disconnect()
+        await b.disconnect()
+
+    @override_settings(ICE_BATCH_WINDOW=60)
+    async def test_pending_candidates_are_sent_on_disconnect(self):
+        a, b = await self.join('leave', 'a', 'b')
+
+        await a.send_json_to({'type': 'webrtc_signal', 'message': self.candidate(0)})
+        self.assertTrue(await b.receive_nothing())
+        await a.disconnect()
+
+        self.assertEqual(await b.receive_json_from(), {
+            'type': 'webrtc_signal', 'message': self.candidate(0), 'username': 'a'
+        })
+        await b.disconnect()
+
+
+class SerializerBuilderTests(TestCase):
+    """The hand-written builders encode to the same bytes as the DRF serializers"""
+
+    def setUp(self):
+        self.a, self.b = anonymous_user(), anonymous_user()
+        self.waiting = VideoCall.objects.create(initiator=self.a)
+        self.ended = VideoCall.objects.create(
+            initiator=self.a, participant=self.b, status='ended',
+            started_at=timezone.now() - timedelta(minutes=5), ended_at=timezone.now(), duration=300
+        )
+        self.message = ChatMessage.objects.create(call=self.ended, sender=self.b, content='hi \u2028 there')
+
+    def assertSameJSON(self, data, serializer):
+        self.assertEqual(codec.dumps(data), JSONRenderer().render(serializer.data))
+
+    def assertBuildersMatch(self):
+        for user in (self.a, self.b):
+            self.assertSameJSON(user_data(user), UserSerializer(user))
+        for call in (self.waiting, self.ended):
+            self.assertSameJSON(call_data(call), VideoCallSerializer(call))
+        self.assertSameJSON(message_data(self.message), ChatMessageSerializer(self.message))
+        self.assertSameJSON(messages_data([self.message]), ChatMessageSerializer([self.message], many=True))
+
+    def test_waiting_call_has_no_participant_or_times(self):
+        self.assertIsNone(call_data(self.waiting)['participant'])
+        self.assertIsNone(call_data(self.waiting)['ended_at'])
+        self.assertBuildersMatch()
+
+    def test_aware_datetimes_in_another_timezone(self):
+        with timezone.override('America/New_York'):
+            self.assertBuildersMatch()
+
+    def test_rows_read_back_from_the_database(self):
+        self.a, self.b = User.objects.get(id=self.a.id), User.objects.get(id=self.b.id)
+        self.waiting = VideoCall.objects.select_related('initiator', 'participant').get(id=self.waiting.id)
+        self.ended = VideoCall.objects.select_related('initiator', 'participant').get(id=self.ended.id)
+        self.message = ChatMessage.objects.select_related('sender').get(id=self.message.id)
+        self.assertBuildersMatch()
+
+    @override_settings(USE_TZ=False)
+    def test_without_time_zone_support(self):
+        self.assertBuildersMatch()
+
+
+class AccountPoolTests(TransactionTestCase):
+    def test_start_fills_the_pool_before_any_claim(self):
+        pool = AccountPool(size=30, batch_size=10, refill_interval=60)
+        pool.start()
+        self.addCleanup(pool.stop)
+
+        deadline = time.monotonic() + 5
+        while pool.metrics()['available'] < 30 and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        self.assertEqual(pool.metrics()['available'], 30)
+        user = pool.claim()
+        self.assertIsNotNone(user)
+        self.assertFalse(User.objects.get(id=user.id).pooled)
+        self.assertEqual(pool.metrics()['hits'], 1)
+
+
+@skipUnless(TcpFakeServer, 'needs fakeredis')
+class RedisChannelLayerTests(SimpleTestCase):
+    """The channel layer REDIS_URL configures, against two local fake Redis nodes"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servers = []
+        for _ in range(2):
+            server = TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            cls.servers.append(server)
+        cls.hosts = [f'redis://127.0.0.1:{server.server_address[1]}' for server in cls.servers]
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.shutdown()
+            server.server_close()
+        super().tearDownClass()
+
+    def worker_layers(self):
+        """Two layers, as two workers sharding groups over both nodes create them"""
+        return [RedisChannelLayer(hosts=self.hosts, **settings.CHANNEL_LAYER_CONFIG) for _ in range(2)]
+
+    async def test_group_send_reaches_socket_of_another_worker(self):
+        sender, receiver = self.worker_layers()
+        try:
+            channels = [await receiver.new_channel() for _ in range(4)]
+            for number, channel in enumerate(channels):
+                await receiver.group_add(f'video_call_{number}', channel)
+            for number in range(len(channels)):
+                await sender.group_send(f'video_call_{number}', {'type': 'chat.message', 'message': number})
+
+            for number, channel in enumerate(channels):
+                event = await asyncio.wait_for(receiver.receive(channel), 5)
+                self.assertEqual(event, {'type': 'chat.message', 'message': number})
+        finally:
+            await sender.close_pools()
+            await receiver.close_pools()
+
+    async def test_per_user_group_delivery(self):
+        sender, receiver = self.worker_layers()
+        registry = GroupChannelRegistry('matching_user')
+        try:
+            tabs = [await receiver.new_channel() for _ in range(2)]
+            other = await receiver.new_channel()
+            for channel in tabs:
+                await registry.register(receiver, 7, channel)
+            await registry.register(receiver, 8, other)
+
+            await registry.send(sender, 7, frame_event({'type': 'match_found', 'call_id': 'c'}))
+
+            for channel in tabs:
+                event = await asyncio.wait_for(receiver.receive(channel), 5)
+                self.assertEqual(codec.loads(event['text'])['call_id'], 'c')
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(receiver.receive(other), 0.2)
+        finally:
+            await sender.close_pools()
+            await receiver.close_pools()
+
+
+class PresenceFlushTests(TestCase):
+    def test_flush_invalidates_cached_users(self):
+        user = User.objects.create_anonymous_user(is_online=False, last_seen=timezone.now() - timedelta(minutes=5))
+        self.assertFalse(user_cache.get_user(user.id).is_online)
+        store = PresenceStore(flush_interval=0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            store.touch(user.id)
+
+        self.assertTrue(user_cache.get_user(user.id).is_online)
+
+
+class CallLifecycleTests(TestCase):
+    def setUp(self):
+        self.a, self.b = anonymous_user(), anonymous_user()
+        # Matching records presence for both users
+        self.addCleanup(presence.clear)
+
+    def pair(self):
+        call = create_call(self.a)
+        create_call(self.b)
+        with transaction.atomic():
+            self.assertTrue(match_calls(self.b, self.a.id, call.id, timezone.now()))
+
+    def test_second_call_is_rejected(self):
+        create_call(self.a)
+
+        with self.assertRaises(IllegalTransition):
+            create_call(User.objects.get(id=self.a.id))
+        self.assertEqual(VideoCall.objects.count(), 1)
+
+    def test_match_against_call_no_longer_waiting(self):
+        call = create_call(self.a)
+        create_call(self.b)
+        transition(VideoCall.objects.filter(id=call.id), 'end', ended_at=timezone.now())
+
+        with transaction.atomic():
+            self.assertFalse(match_calls(self.b, self.a.id, call.id, timezone.now()))
+        self.assertEqual(VideoCall.objects.get(id=call.id).status, 'ended')
+        self.assertEqual(VideoCall.objects.get(initiator=self.b).status, 'waiting')
+
+    def test_end_finishes_both_calls_of_a_pair(self):
+        self.pair()
+
+        finish_call(self.a, 'end')
+
+        self.assertEqual({call.status for call in VideoCall.objects.all()}, {'ended'})
+        self.assertFalse(User.objects.filter(current_call__isnull=False).exists())
+
+    def test_finishing_a_finished_call_is_rejected(self):
+        self.pair()
+        finish_call(self.a, 'skip')
+
+        # self.b still holds the call it had before the partner skipped
+        with self.assertRaises(IllegalTransition):
+            finish_call(self.b, 'end')
+        self.assertEqual({call.status for call in VideoCall.objects.all()}, {'skipped'})
+
+    def test_views_reject_finished_call_with_409(self):
+        self.pair()
+        finish_call(self.a, 'end')
+        client = APIClient()
+        client.force_authenticate(self.b)
+
+        for path in ('/api/v1/call/skip/', '/api/v1/call/end/'):
+            response = client.post(path)
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.json(), {'error': 'Call is already ended'})
+
+
+class ConditionalPollTests(TestCase):
+    def setUp(self):
+        self.a, self.b = anonymous_user(), anonymous_user()
+        self.call = create_call(self.a)
+        self.client = APIClient()
+        self.client.force_authenticate(self.a)
+        self.state_url = f'/api/v1/call/{self.call.id}/'
+        self.messages_url = f'/api/v1/call/{self.call.id}/messages/'
+        self.addCleanup(presence.clear)
+        self.addCleanup(setattr, chat_buffer, 'flush_interval', chat_buffer.flush_interval)
+        chat_buffer.flush_interval = 0
+
+    def etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code
+
+    def test_unchanged_polls_get_304(self):
+        for url in (self.state_url, self.messages_url):
+            self.assertEqual(self.revalidate(url, self.etag(url)), 304)
+
+    def test_sent_message_bumps_messages_only(self):
+        messages_etag, state_etag = self.etag(self.messages_url), self.etag(self.state_url)
+
+        self.client.post(f'{self.messages_url}send/', {'content': 'hi'}, format='json')
+
+        self.assertEqual(self.revalidate(self.messages_url, messages_etag), 200)
+        self.assertEqual(self.revalidate(self.state_url, state_etag), 304)
+
+    def test_clear_bumps_messages(self):
+        ChatMessage.objects.create(
+            call=self.call, sender=self.a, content='old', timestamp=timezone.now() - timedelta(minutes=1)
+        )
+        etag = self.etag(self.messages_url)
+
+        self.client.post(f'{self.messages_url}clear/')
+
+        response = self.client.get(self.messages_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [])
+
+    def test_match_and_end_bump_state_only(self):
+        messages_etag = self.etag(self.messages_url)
+        etag = self.etag(self.state_url)
+
+        create_call(self.b)
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            match_calls(self.b, self.a.id, self.call.id, timezone.now())
+        self.assertEqual(self.revalidate(self.state_url, etag), 200)
+        self.assertEqual(self.revalidate(self.messages_url, messages_etag), 304)
+
+        etag = self.etag(self.state_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            finish_call(User.objects.get(id=self.a.id), 'end')
+        self.assertEqual(self.revalidate(self.state_url, etag), 200)
+
+    def test_bump_in_transaction_waits_for_commit(self):
+        stamp = call_versions.get(self.call.id, 'state')
+
+        with self.captureOnCommitCallbacks() as callbacks, transaction.atomic():
+            call_versions.bump_on_commit([self.call.id], 'state')
+            self.assertEqual(call_versions.get(self.call.id, 'state'), stamp)
+        self.assertEqual(call_versions.get(self.call.id, 'state'), stamp)
+
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(call_versions.get(self.call.id, 'state'), stamp)
+
+
+class MatchQueueTests(SimpleTestCase):
+    def assertConsistent(self, queue):
+        """The random-pick list and positions agree with the waiting users"""
+        self.assertEqual(sorted(queue._ids), sorted(queue._waiting))
+        self.assertEqual(queue._positions, {user_id: index for index, user_id in enumerate(queue._ids)})
+
+    def queue(self, order, user_ids):
+        queue = MatchQueue(order)
+        for user_id in user_ids:
+            queue.enqueue(user_id, f'call-{user_id}')
+        return queue
+
+    def test_pop_partner_never_returns_caller_and_removes_both(self):
+        for order in ('fifo', 'random'):
+            for _ in range(20):
+                queue = self.queue(order, [1, 2, 3])
+                partner_id, call_id = queue.pop_partner(2)
+                self.assertNotEqual(partner_id, 2)
+                self.assertEqual(call_id, f'call-{partner_id}')
+                self.assertNotIn(partner_id, queue)
+                self.assertNotIn(2, queue)
+                self.assertEqual(len(queue), 1)
+
+    def test_pop_partner_alone_finds_nobody(self):
+        queue = self.queue('random', [1])
+        self.assertIsNone(queue.pop_partner(1))
+        self.assertIn(1, queue)
+
+    def test_fifo_keeps_arrival_order(self):
+        queue = self.queue('fifo', [1, 2, 3, 4])
+        # Refreshing a waiting user's call keeps their place
+        queue.enqueue(2, 'call-2b')
+
+        self.assertEqual(queue.pop_partner(9), (1, 'call-1'))
+        self.assertEqual(queue.pop_partner(9), (2, 'call-2b'))
+        self.assertEqual(queue.pop_partner(9), (3, 'call-3'))
+
+    def test_restore_puts_user_back_at_the_front(self):
+        queue = self.queue('fifo', [1, 2, 3])
+        partner_id, call_id = queue.pop_partner(9)
+
+        queue.restore(partner_id, call_id)
+
+        self.assertEqual(queue.pop_partner(9), (1, 'call-1'))
+
+    def test_cancel_keeps_positions_consistent(self):
+        queue = self.queue('random', [1, 2, 3, 4, 5])
+
+        self.assertEqual(queue.cancel(2), 'call-2')  # middle: the last id moves into its slot
+        self.assertConsistent(queue)
+        self.assertEqual(queue.cancel(4), 'call-4')  # the last slot
+        self.assertConsistent(queue)
+        self.assertIsNone(queue.cancel(2))
+        self.assertConsistent(queue)
+        self.assertEqual(sorted(queue._waiting), [1, 3, 5])
+
+    def test_random_pick_never_takes_own_slot(self):
+        queue = self.queue('random', [1, 2, 3])
+        for position in range(3):
+            user_id = queue._ids[position]
+            picks = {queue._pick(user_id) for _ in range(200)}
+            self.assertNotIn(user_id, picks)
+            self.assertEqual(picks, set(queue._ids) - {user_id})
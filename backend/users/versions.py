@@ -0,0 +1,54 @@
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+
+
+class CallVersions:
+    """Version stamps for the parts of a call that clients poll.
+
+    ``kind`` is ``'messages'`` (chat history) or ``'state'`` (status and
+    participants). Every change bumps the stamp to the current time in
+    nanoseconds; views turn it into an ETag and Last-Modified, so a poll
+    that sends the stamp back gets a 304 without touching the data.
+
+    Stamps live in the default cache, which is Redis (shared by every
+    worker) when ``REDIS_URL`` is set. A stamp that was evicted is simply
+    reseeded, costing clients one full response.
+    """
+
+    def __init__(self, cache_alias='default', timeout=86400):
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def key(self, call_id, kind):
+        return f'call_version:{kind}:{call_id}'
+
+    def get(self, call_id, kind):
+        key = self.key(call_id, kind)
+        stamp = self.cache.get(key)
+        if stamp is None:
+            self.cache.add(key, time.time_ns(), self.timeout)
+            stamp = self.cache.get(key)
+        return stamp
+
+    def bump(self, call_ids, kind):
+        stamp = time.time_ns()
+        self.cache.set_many({self.key(call_id, kind): stamp for call_id in call_ids}, self.timeout)
+
+    def bump_on_commit(self, call_ids, kind):
+        """Bump once the current transaction commits (right away outside one).
+
+        Bumping earlier would let a poll pair the new stamp with the old
+        rows and then keep getting 304s for them.
+        """
+        call_ids = [call_id for call_id in call_ids if call_id]
+        if call_ids:
+            transaction.on_commit(lambda: self.bump(call_ids, kind))
+
+
+call_versions = CallVersions()
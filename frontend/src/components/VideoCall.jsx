@@ -60,7 +60,7 @@ const VideoCall = () => {
 
         const connectWebSocket = async () => {
             try {
-                const wsUrl = `${config.WS_BASE_URL}/ws/video_call/${currentCall.id}/?username=${user.username}`;
+                const wsUrl = `${config.WS_BASE_URL}/ws/video_call/${currentCall.id}/?username=${user.username}&token=${localStorage.getItem('access_token')}`;
                 console.log('Connecting to WebSocket:', wsUrl);
                 
                 wsService.connect(wsUrl);
@@ -135,6 +135,10 @@ const VideoCall = () => {
                 case 'webrtc_signal':
                     handleWebRTCSignal(data.message);
                     break;
+                case 'webrtc_signals':
+                    // ICE candidates batched by the server
+                    data.messages.forEach(handleWebRTCSignal);
+                    break;
                 case 'chat_message':
                     // Handle chat message
                     break;
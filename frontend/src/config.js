@@ -50,6 +50,7 @@ const config = {
     // API endpoints - Use proxy paths
     endpoints: {
         register: '/api/v1/register/',
+        status: '/api/v1/status/',
         createCall: '/api/v1/call/create/',
         findMatch: '/api/v1/call/find-match/',
         skipCall: '/api/v1/call/skip/',
@@ -1,7 +1,8 @@
 import React, { createContext, useContext, useReducer, useEffect } from 'react';
-import { register, createCall, findMatch, skipCall, endCall, sendMessage, clearMessages } from '../services/api';
+import { register, updateStatus, createCall, findMatch, skipCall, endCall, sendMessage, clearMessages } from '../services/api';
 import WebSocketService from '../services/websocket';
 import WebRTCService from '../services/webrtc';
+import config from '../config';
 
 const AppContext = createContext();
 
@@ -72,6 +73,7 @@ export const AppProvider = ({ children }) => {
     const [state, dispatch] = useReducer(appReducer, initialState);
     const [wsService] = React.useState(new WebSocketService());
     const [webrtcService] = React.useState(new WebRTCService());
+    const [matchingService] = React.useState(new WebSocketService());
 
     // Check for existing authentication on app startup
     useEffect(() => {
@@ -110,6 +112,16 @@ export const AppProvider = ({ children }) => {
         });
     }, [webrtcService]);
 
+    // Presence heartbeat; the server marks users offline and ends their
+    // calls when this stops (e.g. the tab was closed)
+    useEffect(() => {
+        if (!state.user) return;
+        const interval = setInterval(() => {
+            updateStatus().catch((error) => console.error('Heartbeat failed:', error));
+        }, 30000);
+        return () => clearInterval(interval);
+    }, [state.user]);
+
     // Call duration timer
     useEffect(() => {
         let interval;
@@ -181,6 +193,7 @@ export const AppProvider = ({ children }) => {
             const response = await createCall();
             dispatch({ type: 'SET_CURRENT_CALL', payload: response.data });
             dispatch({ type: 'SET_LOOKING_FOR_MATCH', payload: true });
+            waitForMatch(response.data);
             return response.data;
         } catch (error) {
             dispatch({ type: 'SET_ERROR', payload: error.response?.data?.error || 'Failed to create call' });
@@ -188,6 +201,29 @@ export const AppProvider = ({ children }) => {
         }
     };
 
+    // Register once on the matching socket; the server pushes match_found
+    // when we are paired, so no polling is needed while it stays connected
+    const waitForMatch = async (call) => {
+        try {
+            const username = call.initiator?.username || state.user?.username || '';
+            matchingService.on('onMessage', (data) => {
+                if (data.type === 'match_found' && data.matched_user) {
+                    dispatch({ type: 'SET_MATCHED_USER', payload: data.matched_user });
+                    dispatch({ type: 'SET_LOOKING_FOR_MATCH', payload: false });
+                    dispatch({
+                        type: 'SET_CURRENT_CALL',
+                        payload: { ...data.call, match_type: data.match_type }
+                    });
+                    matchingService.disconnect();
+                }
+            });
+            await matchingService.connect(`${config.WS_BASE_URL}/ws/matching/?username=${username}&token=${localStorage.getItem('access_token')}`);
+            matchingService.send({ type: 'looking_for_match', call_id: call.id });
+        } catch (error) {
+            console.error('Matching socket unavailable, falling back to polling:', error);
+        }
+    };
+
     const findMatchAction = async () => {
         try {
             const response = await findMatch();
@@ -221,6 +257,7 @@ export const AppProvider = ({ children }) => {
             console.log('Refresh token:', localStorage.getItem('refresh_token') ? 'Present' : 'Missing');
             
             await skipCall();
+            matchingService.disconnect();
             dispatch({ type: 'RESET_CALL' });
             webrtcService.destroy();
         } catch (error) {
@@ -233,6 +270,7 @@ export const AppProvider = ({ children }) => {
     const endCallAction = async () => {
         try {
             await endCall();
+            matchingService.disconnect();
             dispatch({ type: 'RESET_CALL' });
             webrtcService.destroy();
         } catch (error) {
@@ -51,12 +51,17 @@ const apiCall = async (method, endpoint, data = null, useDirectBackend = false)
 
 // API functions
 export const register = () => apiCall('post', config.endpoints.register);
+export const updateStatus = () => apiCall('post', config.endpoints.status);
 export const createCall = () => apiCall('post', config.endpoints.createCall);
 export const findMatch = () => apiCall('post', config.endpoints.findMatch);
 export const skipCall = () => apiCall('post', config.endpoints.skipCall);
 export const endCall = () => apiCall('post', config.endpoints.endCall);
 export const sendMessage = (callId, content) => apiCall('post', config.endpoints.sendMessage(callId), { content });
-export const getMessages = (callId) => apiCall('get', config.endpoints.getMessages(callId));
+// Pass the last response's next_cursor to get only messages sent since
+export const getMessages = (callId, cursor = null) => apiCall(
+    'get',
+    cursor ? `${config.endpoints.getMessages(callId)}?cursor=${encodeURIComponent(cursor)}` : config.endpoints.getMessages(callId)
+);
 export const clearMessages = (callId) => apiCall('post', config.endpoints.clearMessages(callId));
 
 // Create a simple API instance for backward compatibility